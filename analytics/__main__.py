@@ -0,0 +1,4 @@
+from analytics.cli import main
+import sys
+
+sys.exit(main())
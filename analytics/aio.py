@@ -0,0 +1,170 @@
+"""
+asyncio transport for the Reporting API. Requests are the same batchGet bodies the synchronous connections build,
+POSTed over one pooled keep-alive aiohttp session, so many reports can be in flight from a single thread:
+
+    async with AsyncAnalyticsConnection(credentials="connection.json", view_id="118513499") as connection:
+        async for row in connection.iter_rows(page):
+            ...
+
+aiohttp is only needed when a connection is opened without a service, and asyncio is only imported once a
+connection is created, so importing the scripts stays cheap.
+"""
+from analytics.scheduler import CONCURRENT_REQUESTS_PER_VIEW
+from functools import partial
+from types import SimpleNamespace
+import time
+
+REPORTS_URL = "https://analyticsreporting.googleapis.com/v4/reports:batchGet"
+
+
+class ReportingHttpError(RuntimeError):
+    """
+    A batchGet call that did not return 200. The status is exposed as error.resp.status, like googleapiclient's
+    HttpError, so RequestScheduler and Metrics classify both the same way.
+    """
+    def __init__(self, status, content):
+        super().__init__(f"Reporting API returned HTTP {status}: {content[:500]}")
+        self.resp = SimpleNamespace(status=status)
+        self.content = content
+
+
+class AsyncReportingConnection:
+    """
+    Async counterpart of ReportingConnection. At most `concurrency` requests are sent at once; the scheduler, when
+    given, still enforces the per-project, per-user and per-view quotas. A service (such as FakeReportingService)
+    replaces the HTTP session, with each call run on a worker thread.
+    """
+    def __init__(
+            self,
+            credentials,
+            view_id,
+            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
+            concurrency=CONCURRENT_REQUESTS_PER_VIEW,
+            cache=None,
+            service=None,
+            metrics=None,
+            scheduler=None,
+    ):
+        import asyncio
+        self.credentials_location = credentials
+        self.view_id = view_id
+        self.scopes = scopes
+        self.concurrency = concurrency
+        self.cache = cache
+        self.service = service
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.results = []
+        self.credentials = None
+        self.session = None
+        self.__token = None
+        self.__token_expires = 0.0
+        self.__token_lock = asyncio.Lock()
+        self.__limit = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.service is not None or self.session is not None:
+            return
+        import aiohttp
+        from oauth2client.service_account import ServiceAccountCredentials
+        self.credentials = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_location, self.scopes)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=300),
+            raise_for_status=False,
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __access_token(self, refresh=False):
+        import asyncio
+        async with self.__token_lock:
+            if refresh or self.__token is None or time.monotonic() > self.__token_expires:
+                # oauth2client refreshes over a blocking http call, so keep it off the event loop.
+                token = await asyncio.to_thread(self.credentials.get_access_token)
+                self.__token = token.access_token
+                self.__token_expires = time.monotonic() + (token.expires_in or 3600) - 60
+            return self.__token
+
+    async def __post(self, request):
+        import aiohttp
+        for attempt in range(2):
+            headers = {'Authorization': f"Bearer {await self.__access_token(refresh=attempt > 0)}"}
+            try:
+                async with self.session.post(REPORTS_URL, json=request, headers=headers) as response:
+                    if response.status == 401 and attempt == 0:
+                        continue
+                    if response.status != 200:
+                        raise ReportingHttpError(response.status, await response.text())
+                    return await response.json()
+            except aiohttp.ClientConnectionError as error:
+                raise ConnectionError(str(error)) from error
+
+    async def __send(self, request):
+        import asyncio
+        async with self.__limit:
+            if self.service is not None:
+                return await asyncio.to_thread(self.service.reports().batchGet(body=request).execute)
+            return await self.__post(request)
+
+    def __record_error(self, error):
+        if self.metrics is not None:
+            self.metrics.record_error(error)
+
+    async def execute(self, request):
+        start = time.perf_counter()
+        if self.service is None and self.session is None:
+            await self.open()
+        if self.cache is not None:
+            response = self.cache.get(request)
+            if response is not None:
+                if self.metrics is not None:
+                    self.metrics.record_request(time.perf_counter() - start, response, cached=True)
+                return response
+        if self.scheduler is not None:
+            response = await self.scheduler.call_async(
+                self.view_id, partial(self.__send, request), on_error=self.__record_error
+            )
+        else:
+            try:
+                response = await self.__send(request)
+            except Exception as error:
+                self.__record_error(error)
+                raise
+        if self.metrics is not None:
+            self.metrics.record_request(time.perf_counter() - start, response)
+        if self.cache is not None:
+            self.cache.put(request, response)
+        return response
+
+    async def iter_report_pages(self, report_request):
+        request = dict(report_request)
+        while True:
+            report = (await self.execute({"reportRequests": [request]}))['reports'][0]
+            yield report
+            if 'nextPageToken' not in report:
+                return
+            request = dict(request, pageToken=str(report['nextPageToken']))
+
+    async def iter_report_rows(self, report_request):
+        async for report in self.iter_report_pages(report_request):
+            for row in report.get('data', {}).get('rows', []):
+                yield row
+
+    async def collect_rows(self, report_request):
+        return [row async for row in self.iter_report_rows(report_request)]
+
+    async def gather_rows(self, report_requests):
+        """Rows for every report request, fetched concurrently and returned in the same order."""
+        import asyncio
+        return await asyncio.gather(*(self.collect_rows(report_request) for report_request in report_requests))
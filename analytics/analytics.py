@@ -1,85 +1,300 @@
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
+from analytics.aio import AsyncReportingConnection
+from analytics.cache import ResponseCache
+from analytics.cli import add_connection_arguments, load_config
+from analytics.connection import ReportingConnection, thread_local_connection
+from analytics.metrics import Metrics
+from analytics.rollup import complete_months, month_key
+from analytics.scheduler import CONCURRENT_REQUESTS_PER_VIEW, RequestScheduler
+from analytics.sharding import DateRangeSharder, resolve_date
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from collections import Counter
+import argparse
+import csv
+import os
+import re
 
+MAX_REPORT_REQUESTS = 5
+BULK_CHUNK_SIZE = 50
+DEFAULT_SOURCES = {
+    'search.google.com': 'google',
+    't.co': 'twitter',
+    'lm.facebook.com': 'facebook',
+    'l.facebook.com': 'facebook',
+    'us13.campaign-archive.com': 'mailchimp',
+}
+DEFAULT_REFERRALS = {
+    'primo': 'utk.primo.exlibrisgroup.com',
+}
 
-class AnalyticsConnection:
-    def __init__(
-            self,
-            credentials,
-            view_id,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-    ):
-        self.credentials_location = credentials
-        self.view_id = view_id
-        self.scopes = scopes
-        self.results = []
-        self.connection = self.__connect()
-
-    def __connect(self):
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            self.credentials_location, self.scopes
-        )
-        return build("analyticsreporting", "v4", credentials=credentials)
 
-    def find_pages(self, page, token=None, start_date="45daysAgo", end_date="today"):
+class CollectionRequests:
+    """
+    Report requests for the collection reports, shared by AnalyticsConnection and AsyncAnalyticsConnection.
+    find_pages returns whatever execute returns, and iter_rows whatever iter_report_rows returns, so on the async
+    connection they give a coroutine and an async generator.
+    """
+    def build_request(self, page, token=None, start_date="45daysAgo", end_date="today"):
         request = {
-            "reportRequests": [
+            "viewId": self.view_id,
+            "dateRanges": [
+                {"startDate": start_date, "endDate": end_date}
+            ],
+            "metrics": [{"expression": "ga:uniquePageviews"}],
+            "dimensions": [
+                {"name": "ga:pagePath"},
+                {"name": "ga:fullReferrer"},
+                {"name": "ga:source"},
+                {"name": "ga:pageTitle"},
+                {"name": "ga:yearMonth"},
+            ],
+            "pageSize": 10000,
+            "dimensionFilterClauses": [
                 {
-                    "viewId": self.view_id,
-                    "dateRanges": [
-                        {"startDate": start_date, "endDate": end_date}
-                    ],
-                    "metrics": [{"expression": "ga:uniquePageviews"}],
-                    "dimensions": [{"name": "ga:pagePath"}, {"name": "ga:fullReferrer"}, {"name": "ga:source"}, {"name": "ga:pageTitle"}],
-                    "pageSize": 10000,
-                    "dimensionFilterClauses": [
+                    "filters": [
                         {
-                            "filters": [
-                                {
-                                    "operator": "EXACT",
-                                    "dimensionName": "ga:landingPagePath",
-                                    "expressions": [
-                                        page
-                                    ]
-                                }
+                            "operator": "EXACT",
+                            "dimensionName": "ga:landingPagePath",
+                            "expressions": [
+                                page
                             ]
                         }
-                    ],
+                    ]
                 }
-            ]
+            ],
         }
         if token is not None:
-            request['reportRequests'][0]['pageToken'] = str(token)
-        return (
-            self.connection.reports()
-            .batchGet(
-                body=request
+            request['pageToken'] = str(token)
+        return request
+
+    def build_bulk_request(self, pages, token=None, start_date="45daysAgo", end_date="today"):
+        """
+        One report for many collections: an IN_LIST filter on ga:landingPagePath, with ga:landingPagePath added as
+        the last dimension so each row can be matched back to its collection locally.
+        """
+        request = self.build_request(pages[0], token=token, start_date=start_date, end_date=end_date)
+        request['dimensions'] = request['dimensions'] + [{"name": "ga:landingPagePath"}]
+        request['dimensionFilterClauses'][0]['filters'][0]['operator'] = "IN_LIST"
+        request['dimensionFilterClauses'][0]['filters'][0]['expressions'] = list(pages)
+        return request
+
+    def find_pages(self, page, token=None, start_date="45daysAgo", end_date="today"):
+        return self.execute(
+            {
+                "reportRequests": [
+                    self.build_request(page, token=token, start_date=start_date, end_date=end_date)
+                ]
+            }
+        )
+
+    def find_pages_batch(self, pages, tokens=None, start_date="45daysAgo", end_date="today"):
+        """
+        Packs several collections into one batchGet. The Reporting API v4 accepts at most five reportRequests per
+        call, and every request in the batch must share the same view and date range.
+        """
+        if len(pages) > MAX_REPORT_REQUESTS:
+            raise ValueError(f"batchGet accepts at most {MAX_REPORT_REQUESTS} reportRequests, got {len(pages)}")
+        tokens = tokens or {}
+        return self.execute(
+            {
+                "reportRequests": [
+                    self.build_request(page, token=tokens.get(page), start_date=start_date, end_date=end_date)
+                    for page in pages
+                ]
+            }
+        )
+
+    def iter_rows(self, page, start_date="45daysAgo", end_date="today"):
+        return self.iter_report_rows(self.build_request(page, start_date=start_date, end_date=end_date))
+
+    def bulk_requests(self, pages, start_date="45daysAgo", end_date="today", chunk_size=BULK_CHUNK_SIZE):
+        pages = list(pages)
+        return [
+            self.build_bulk_request(pages[i:i + chunk_size], start_date=start_date, end_date=end_date)
+            for i in range(0, len(pages), chunk_size)
+        ]
+
+
+class AnalyticsConnection(CollectionRequests, ReportingConnection):
+    def iter_bulk_rows(self, pages, start_date="45daysAgo", end_date="today", chunk_size=BULK_CHUNK_SIZE):
+        for request in self.bulk_requests(pages, start_date=start_date, end_date=end_date, chunk_size=chunk_size):
+            yield from self.iter_report_rows(request)
+
+    def process_pages(self, page, start_date="45daysAgo", end_date="today"):
+        self.results = list(self.iter_rows(page, start_date=start_date, end_date=end_date))
+        return self.results
+
+
+class AsyncAnalyticsConnection(CollectionRequests, AsyncReportingConnection):
+    async def process_pages(self, page, start_date="45daysAgo", end_date="today"):
+        self.results = [row async for row in self.iter_rows(page, start_date=start_date, end_date=end_date)]
+        return self.results
+
+    async def fetch(self, pages, start_date="45daysAgo", end_date="today"):
+        """Rows for every collection, with all of their reports in flight at once."""
+        pages = list(pages)
+        async with self:
+            results = await self.gather_rows(
+                [self.build_request(page, start_date=start_date, end_date=end_date) for page in pages]
+            )
+        return dict(zip(pages, results))
+
+
+class CollectionIndex:
+    """
+    Hash index of the collections in config.yml. A row belongs to a collection when both its ga:pagePath and its
+    ga:landingPagePath are exactly that collection, which is what the per-collection EXACT queries kept.
+    """
+    def __init__(self, collections):
+        self.__collections = frozenset(collections)
+
+    def __contains__(self, page):
+        return page in self.__collections
+
+    def match(self, page_path, landing_page_path):
+        if page_path == landing_page_path and page_path in self.__collections:
+            return page_path
+        return None
+
+    def dispatch(self, rows):
+        for row in rows:
+            collection = self.match(row['dimensions'][0], row['dimensions'][-1])
+            if collection is not None:
+                yield collection, row
+
+
+class BatchReportFetcher:
+    """
+    Fans a list of collections out over a bounded thread pool. Collections are grouped into batchGet calls of up
+    to five reportRequests and each worker thread keeps its own AnalyticsConnection, since the underlying http
+    client is not thread-safe.
+    """
+    def __init__(
+            self,
+            credentials,
+            view_id,
+            batch_size=MAX_REPORT_REQUESTS,
+            workers=4,
+            cache=None,
+            service=None,
+            metrics=None,
+            scheduler=None,
+    ):
+        self.credentials = credentials
+        self.view_id = view_id
+        self.batch_size = min(batch_size, MAX_REPORT_REQUESTS)
+        self.workers = workers
+        self.cache = cache
+        self.service = service
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.__connection = thread_local_connection(
+            partial(
+                AnalyticsConnection,
+                credentials=credentials,
+                view_id=view_id,
+                cache=cache,
+                service=service,
+                metrics=metrics,
+                scheduler=scheduler,
             )
-            .execute()
         )
 
-    def process_pages(self, page, initial_pages=None, start_date=None, end_date=None):
-        if initial_pages is None and start_date is not None and end_date is not None:
-            current_set = self.find_pages(page, start_date=start_date, end_date=end_date)
-        elif initial_pages is None:
-            current_set = self.find_pages()
-        else:
-            current_set = initial_pages
+    def __fetch_batch(self, pages, start_date, end_date):
+        connection = self.__connection()
+        results = {page: [] for page in pages}
+        tokens = {}
+        pending = list(pages)
+        while len(pending) > 0:
+            response = connection.find_pages_batch(pending, tokens=tokens, start_date=start_date, end_date=end_date)
+            still_pending = []
+            for page, report in zip(pending, response['reports']):
+                results[page].extend(report.get('data', {}).get('rows', []))
+                if 'nextPageToken' in report:
+                    tokens[page] = report['nextPageToken']
+                    still_pending.append(page)
+            pending = still_pending
+        return results
+
+    def batches(self, pages):
+        pages = list(pages)
+        return [pages[i:i + self.batch_size] for i in range(0, len(pages), self.batch_size)]
+
+    def fetch(self, pages, start_date="45daysAgo", end_date="today"):
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.__fetch_batch, batch, start_date, end_date)
+                for batch in self.batches(pages)
+            ]
+            for future in as_completed(futures):
+                results.update(future.result())
+        return results
+
+
+class SourceNormalizer:
+    """
+    Maps raw ga:source values to the names we report on. Rules come from the sources section of config.yml and are
+    compiled once: exact domains first, then domain suffixes (longest first), then regular expressions. Every
+    source and referrer seen is memoized, so a stream of rows costs one dict lookup per row after warm-up.
+    """
+    def __init__(self, domains=None, suffixes=None, patterns=None, referrals=None):
+        self.domains = dict(DEFAULT_SOURCES if domains is None else domains)
+        self.suffixes = sorted((suffixes or {}).items(), key=lambda x: len(x[0]), reverse=True)
+        self.patterns = [(re.compile(pattern), name) for pattern, name in (patterns or {}).items()]
+        self.referrals = dict(DEFAULT_REFERRALS if referrals is None else referrals)
+        self.__sources = {}
+        self.__referrals = {}
+
+    @classmethod
+    def from_config(cls, config):
+        rules = config.get('sources', {}) or {}
+        return cls(
+            domains=rules.get('domains'),
+            suffixes=rules.get('suffixes'),
+            patterns=rules.get('patterns'),
+            referrals=rules.get('referrals'),
+        )
+
+    def __normalize(self, source):
+        if source in self.domains:
+            return self.domains[source]
+        for suffix, name in self.suffixes:
+            if source == suffix or source.endswith('.' + suffix):
+                return name
+        for pattern, name in self.patterns:
+            if pattern.search(source):
+                return name
+        return source
+
+    def normalize(self, source):
         try:
-            for view in current_set['reports'][0]['data']['rows']:
-                self.results.append(view)
+            return self.__sources[source]
         except KeyError:
-            pass
-        if 'nextPageToken' in current_set['reports'][0]:
-            new_request = self.find_pages(token=current_set['reports'][0]['nextPageToken'])
-            return self.process_pages(new_request)
-        else:
-            return
+            name = self.__sources[source] = self.__normalize(source)
+            return name
+
+    def referral(self, referrer):
+        """The name of the first referral rule whose marker appears in ga:fullReferrer, or None."""
+        try:
+            return self.__referrals[referrer]
+        except KeyError:
+            name = next((name for name, marker in self.referrals.items() if marker in referrer), None)
+            self.__referrals[referrer] = name
+            return name
+
+    def combine(self, data):
+        combined = {}
+        for source, views in data.items():
+            name = self.normalize(source)
+            combined[name] = combined.get(name, 0) + views
+        return combined
 
 
 class AnalyticsInterpretter:
-    def __init__(self, data):
-        self.original_data = self.__sort_traffic_sources(self.__combine_similar_sources(data))
+    def __init__(self, data, normalizer=None):
+        self.normalizer = normalizer or SourceNormalizer()
+        self.original_data = self.__sort_traffic_sources(self.normalizer.combine(data))
         self.total_views = self.__get_total_views(data)
         self.data_as_percentages = self.__as_percentages()
 
@@ -106,66 +321,137 @@ class AnalyticsInterpretter:
     def __sort_traffic_sources(sortable):
         return dict(sorted(sortable.items(), key=lambda x: x[1], reverse=True))
 
-    @staticmethod
-    def __combine_similar_sources(data):
-        sources_to_replace = {
-            'search.google.com': 'google',
-            't.co': 'twitter',
-            'lm.facebook.com': 'facebook',
-            'l.facebook.com': 'facebook',
-            'us13.campaign-archive.com': 'mailchimp',
-        }
-        values_to_pop = []
-        values_to_add = []
-        for k, v in data.items():
-            if k in sources_to_replace:
-                values_to_pop.append(k)
-                values_to_add.append({ sources_to_replace[k]: v})
-        for value in values_to_pop:
-            data.pop(value)
-        for value in values_to_add:
-            for k, v in value.items():
-                if k in data:
-                    data[k] += v
-                else:
-                    data[k] = v
-        return data
-
 
-if __name__ == "__main__":
-    import yaml
-    collections = yaml.safe_load(open('config.yml', 'r'))['collections']
-    connection = AnalyticsConnection(
-        credentials="connection.json",
-        view_id="118513499",
+def main(argv=None, prog=None, service=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Traffic sources for the collections in config.yml.')
+    add_connection_arguments(parser, view_id="118513499")
+    parser.add_argument('--start-date', default='365daysago', help='First day of the report.')
+    parser.add_argument('--end-date', default='today', help='Last day of the report.')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--workers', type=int, help='Fan batched requests out over this many threads.')
+    mode.add_argument('--bulk', action='store_true', help='Pull one combined report and match rows locally.')
+    mode.add_argument('--async', dest='use_async', action='store_true', help='Fetch every collection over asyncio.')
+    parser.add_argument('--concurrency', type=int, help='Requests in flight at once with --async (default 10).')
+    parser.add_argument('--shard-days', type=int, help='Split the date range into shards of this many days.')
+    parser.add_argument('--shard-workers', type=int, default=4, help='Number of shards to fetch at once.')
+    parser.add_argument(
+        '--output',
+        default='datasets/sources.csv',
+        help='Views by collection, source and month, for the months the date range fully covers.',
+    )
+    args = parser.parse_args(argv)
+    if args.shard_days and (args.use_async or args.workers):
+        parser.error('--shard-days cannot be combined with --async or --workers')
+    if args.concurrency is not None and not args.use_async:
+        parser.error('--concurrency only applies with --async')
+    cache = None if args.no_cache else ResponseCache(args.cache_file)
+    metrics = Metrics.for_file(args.metrics)
+    request_scheduler = RequestScheduler()
+    config = load_config(args.config)
+    collections = config['collections']
+    normalizer = SourceNormalizer.from_config(config)
+    connect = partial(
+        AnalyticsConnection,
+        credentials=args.credentials,
+        view_id=args.view_id,
+        cache=cache,
+        service=service,
+        metrics=metrics,
+        scheduler=request_scheduler,
     )
+    sharder = None
+    if args.shard_days:
+        sharder = DateRangeSharder(connect, shard_days=args.shard_days, workers=args.shard_workers)
+    if args.bulk:
+        connection = connect()
+        requests = connection.bulk_requests(collections, start_date=args.start_date, end_date=args.end_date)
+        read = sharder.iter_rows if sharder is not None else connection.iter_report_rows
+        matches = CollectionIndex(collections).dispatch(row for request in requests for row in read(request))
+    else:
+        if args.use_async:
+            import asyncio
+            connection = AsyncAnalyticsConnection(
+                credentials=args.credentials,
+                view_id=args.view_id,
+                concurrency=args.concurrency or CONCURRENT_REQUESTS_PER_VIEW,
+                cache=cache,
+                service=service,
+                metrics=metrics,
+                scheduler=request_scheduler,
+            )
+            results_by_collection = asyncio.run(
+                connection.fetch(collections, start_date=args.start_date, end_date=args.end_date)
+            ).items()
+        elif args.workers:
+            fetcher = BatchReportFetcher(
+                credentials=args.credentials,
+                view_id=args.view_id,
+                workers=args.workers,
+                cache=cache,
+                service=service,
+                metrics=metrics,
+                scheduler=request_scheduler,
+            )
+            results_by_collection = fetcher.fetch(collections, start_date=args.start_date, end_date=args.end_date).items()
+        elif sharder is not None:
+            connection = connect()
+            results_by_collection = (
+                (
+                    collection,
+                    sharder.iter_rows(connection.build_request(collection, start_date=args.start_date, end_date=args.end_date))
+                )
+                for collection in collections
+            )
+        else:
+            connection = connect()
+            results_by_collection = (
+                (collection, connection.iter_rows(collection, start_date=args.start_date, end_date=args.end_date))
+                for collection in collections
+            )
+        """
+        Must ensure that the ga:pagePath is the same as what's in the config because ga:landingPagePaths do not
+        ignore HTTP parameters like queries 
+        (e.g. digital.lib.utk.edu/collections/islandora/object/collections:volvoices?page=16).
+        """
+        matches = (
+            (collection, result)
+            for collection, results in results_by_collection
+            for result in results
+            if result['dimensions'][0] == collection
+        )
     all_sources = {}
     primo_collections = {}
-    for collection in collections:
-        page = collection
-        connection.process_pages(page=page, start_date='365daysago', end_date='today',)
-        results = connection.results
-        for result in results:
-            """
-            Must ensure that the ga:pagePath is the same as what's in the config because ga:landingPagePaths do not
-            ignore HTTP parameters like queries 
-            (e.g. digital.lib.utk.edu/collections/islandora/object/collections:volvoices?page=16).
-            """
-            if result['dimensions'][0] == collection:
-                x = {
-                    'source': result['dimensions'][1],
-                    'views': int(result['metrics'][0]['values'][0]),
-                    "actual_source": result['dimensions'][2]
-                }
-                if x['actual_source'] not in all_sources:
-                    all_sources[x['actual_source']] = x['views']
-                else:
-                    all_sources[x['actual_source']] += x['views']
-                if "utk.primo.exlibrisgroup.com" in x['source']:
-                    if collection not in primo_collections:
-                        primo_collections[collection] = x['views']
-                    else:
-                        primo_collections[collection] += x['views']
-    print(AnalyticsInterpretter(all_sources).original_data)
-    print(AnalyticsInterpretter(all_sources).data_as_percentages)
-    print(dict(sorted(primo_collections.items(), key=lambda x: x[1], reverse=True)))
\ No newline at end of file
+    cells = Counter()
+    with metrics.stage('collect'):
+        for collection, result in matches:
+            views = int(result['metrics'][0]['values'][0])
+            source = normalizer.normalize(result['dimensions'][2])
+            all_sources[source] = all_sources.get(source, 0) + views
+            cells[(collection, source, month_key(result['dimensions'][4]))] += views
+            if normalizer.referral(result['dimensions'][1]) == 'primo':
+                primo_collections[collection] = primo_collections.get(collection, 0) + views
+    with metrics.stage('write'):
+        complete = complete_months(resolve_date(args.start_date), resolve_date(args.end_date))
+        open_months = sorted({month for _, _, month in cells} - complete)
+        if open_months:
+            print(f'Leaving partial months out of {args.output}: {", ".join(open_months)}')
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['collection', 'source', 'month', 'views'])
+            for (collection, source, month), views in sorted(cells.items()):
+                if month in complete:
+                    writer.writerow([collection, source, month, views])
+    with metrics.stage('interpret'):
+        interpretter = AnalyticsInterpretter(all_sources, normalizer=normalizer)
+        print(interpretter.original_data)
+        print(interpretter.data_as_percentages)
+        print(dict(sorted(primo_collections.items(), key=lambda x: x[1], reverse=True)))
+    print(f'Quota (daily budgets count this run only): {request_scheduler.remaining()}')
+    if args.metrics is not None:
+        metrics.write(args.metrics)
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,100 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# GA keeps reprocessing the most recent days, so a range only counts as closed once its end is this far back.
+PROCESSING_DAYS = 2
+
+
+class ResponseCache:
+    """
+    SQLite store of batchGet responses keyed by a hash of the canonical request body (which includes any pageToken).
+    Responses for date ranges that are fully in the past never expire; anything relative or still open, like
+    365daysago to today, is kept for ttl seconds. An entry's expires is only NULL if its range was already closed
+    when it was cached, so a page cached while its range was open is dropped as soon as the range closes rather than
+    outliving it as partial data. Once the stored bodies pass max_bytes the least recently read entries are evicted.
+    """
+    def __init__(self, location="reporting_cache.sqlite", ttl=6 * 60 * 60, max_bytes=512 * 1024 * 1024):
+        self.location = location
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(location, check_same_thread=False)
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, expires REAL, accessed REAL NOT NULL)"
+        )
+        self.__db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.__db.commit()
+
+    @staticmethod
+    def key(request):
+        canonical = json.dumps(request, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def is_closed(request, today=None):
+        cutoff = (today or datetime.date.today()) - datetime.timedelta(days=PROCESSING_DAYS)
+        for report in request.get('reportRequests', []):
+            for date_range in report.get('dateRanges', []):
+                try:
+                    end = datetime.date.fromisoformat(date_range['endDate'])
+                except (KeyError, ValueError):
+                    return False
+                if end >= cutoff:
+                    return False
+        return True
+
+    def get(self, request):
+        key = self.key(request)
+        now = time.time()
+        with self.__lock:
+            row = self.__db.execute("SELECT body, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            body, expires = row
+            if expires is not None and (expires < now or self.is_closed(request)):
+                self.__db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.__db.commit()
+                return None
+            self.__db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.__db.commit()
+        return json.loads(zlib.decompress(body))
+
+    def put(self, request, response):
+        body = zlib.compress(json.dumps(response, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+        expires = None if self.is_closed(request) else now + self.ttl
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.key(request), body, len(body), expires, now)
+            )
+            self.__evict(now)
+            self.__db.commit()
+
+    def __evict(self, now):
+        self.__db.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?", (now,))
+        total = self.__db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self.__db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            stale.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.__db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def clear(self):
+        with self.__lock:
+            self.__db.execute("DELETE FROM responses")
+            self.__db.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,59 @@
+"""
+Single entry point for the reporting scripts:
+
+    collection-query analytics --bulk
+    collection-query search-terms --top 100
+    collection-query streamer --start 2022-01 --end 2022-12
+    collection-query merge --output months/final
+    collection-query rollup
+    collection-query dashboard --port 8050
+
+Each subcommand's module is only imported when it is run, and the Google client libraries are only imported when
+a connection is opened. Every module's main(argv, prog, service) can also be called directly; a service, such as
+analytics.fake.FakeReportingService, then answers the reports instead of the Reporting API.
+"""
+import argparse
+import importlib
+import sys
+
+COMMANDS = {
+    'analytics': ('analytics.analytics', 'Traffic sources for the collections in config.yml.'),
+    'search-terms': ('analytics.search_terms', 'Search terms used on digital.lib.utk.edu.'),
+    'streamer': ('analytics.streamer', 'Monthly views for every stream.lib.utk.edu path.'),
+    'merge': ('analytics.merge', 'Rebuild the month pivot from per-month CSVs.'),
+    'rollup': ('analytics.rollup', 'Roll analytics and streamer output up into a cube.'),
+    'dashboard': ('analytics.dashboard', 'Serve a dashboard over the rollup cube.'),
+}
+
+
+def add_connection_arguments(parser, view_id):
+    parser.add_argument('--credentials', default='connection.json', help='Service account key file.')
+    parser.add_argument('--view-id', default=view_id, help=f'Google Analytics view to query (default {view_id}).')
+    parser.add_argument('--config', default='config.yml', help='Collections and rules file.')
+    parser.add_argument('--no-cache', action='store_true', help='Always query the API instead of the local cache.')
+    parser.add_argument('--cache-file', default='reporting_cache.sqlite', help='Location of the response cache.')
+    parser.add_argument('--metrics', help='Write run metrics to this file: Prometheus text for *.prom, else JSON lines.')
+
+
+def load_config(filename):
+    import yaml
+    with open(filename, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='collection-query',
+        description=__doc__.strip().splitlines()[0].rstrip(':') + '.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(f"  {name:<14}{description}" for name, (_, description) in COMMANDS.items()),
+    )
+    parser.add_argument('command', choices=COMMANDS, help='Run "collection-query COMMAND --help" for its options.')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    module = importlib.import_module(COMMANDS[args.command][0])
+    return module.main(args.args, prog=f"collection-query {args.command}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+from functools import lru_cache, partial
+import json
+import os
+import threading
+import time
+
+DISCOVERY_URL = "https://analyticsreporting.googleapis.com/$discovery/rest?version=v4"
+DISCOVERY_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'collection_query', 'analyticsreporting.v4.json')
+
+
+@lru_cache(maxsize=None)
+def discovery_document():
+    """
+    The analyticsreporting v4 discovery document, parsed once per process. google-api-python-client bundles it;
+    older releases that do not are served from a copy downloaded once to DISCOVERY_CACHE.
+    """
+    from googleapiclient import discovery_cache
+    document = discovery_cache.get_static_doc("analyticsreporting", "v4")
+    if document is None and os.path.exists(DISCOVERY_CACHE):
+        with open(DISCOVERY_CACHE) as f:
+            document = f.read()
+    if document is None:
+        import httplib2
+        response, content = httplib2.Http().request(DISCOVERY_URL)
+        if response.status != 200:
+            raise RuntimeError(f"Could not download the analyticsreporting discovery document: HTTP {response.status}")
+        document = content.decode('utf-8')
+        os.makedirs(os.path.dirname(DISCOVERY_CACHE), exist_ok=True)
+        with open(DISCOVERY_CACHE, 'w') as f:
+            f.write(document)
+    return json.loads(document)
+
+
+def thread_local_connection(factory):
+    """
+    Returns a function that gives each calling thread its own connection, made by factory() on that thread's first
+    call and reused after. The http client under a connection is not safe to share between threads.
+    """
+    local = threading.local()
+
+    def connection():
+        if not hasattr(local, 'connection'):
+            local.connection = factory()
+        return local.connection
+    return connection
+
+
+class ReportingConnection:
+    def __init__(
+            self,
+            credentials,
+            view_id,
+            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
+            cache=None,
+            service=None,
+            metrics=None,
+            scheduler=None,
+    ):
+        self.credentials_location = credentials
+        self.view_id = view_id
+        self.scopes = scopes
+        self.cache = cache
+        self.service = service
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.results = []
+        self.connection = self.__connect()
+
+    def __connect(self):
+        if self.service is not None:
+            return self.service
+        from oauth2client.service_account import ServiceAccountCredentials
+        from googleapiclient.discovery import build_from_document
+        credentials = ServiceAccountCredentials.from_json_keyfile_name(
+            self.credentials_location, self.scopes
+        )
+        return build_from_document(discovery_document(), credentials=credentials)
+
+    def __send(self, request):
+        return (
+            self.connection.reports()
+            .batchGet(
+                body=request
+            )
+            .execute()
+        )
+
+    def __record_error(self, error):
+        if self.metrics is not None:
+            self.metrics.record_error(error)
+
+    def execute(self, request):
+        start = time.perf_counter()
+        if self.cache is not None:
+            response = self.cache.get(request)
+            if response is not None:
+                if self.metrics is not None:
+                    self.metrics.record_request(time.perf_counter() - start, response, cached=True)
+                return response
+        if self.scheduler is not None:
+            response = self.scheduler.call(self.view_id, partial(self.__send, request), on_error=self.__record_error)
+        else:
+            try:
+                response = self.__send(request)
+            except Exception as error:
+                self.__record_error(error)
+                raise
+        if self.metrics is not None:
+            self.metrics.record_request(time.perf_counter() - start, response)
+        if self.cache is not None:
+            self.cache.put(request, response)
+        return response
+
+    def iter_report_pages(self, report_request):
+        """
+        Yields each page of a single report. Follow-up requests are copies of the original with only the pageToken
+        changed, so filters and date ranges carry over to every page.
+        """
+        request = dict(report_request)
+        while True:
+            report = self.execute({"reportRequests": [request]})['reports'][0]
+            yield report
+            if 'nextPageToken' not in report:
+                return
+            request = dict(request, pageToken=str(report['nextPageToken']))
+
+    def iter_report_rows(self, report_request):
+        for report in self.iter_report_pages(report_request):
+            for row in report.get('data', {}).get('rows', []):
+                yield row
@@ -0,0 +1,117 @@
+"""
+Dash app over the rollup cube:
+
+    collection-query dashboard --cube datasets/rollup.json
+
+Every chart is read from the cube's precomputed totals, so changing a filter or clicking a bar to drill into a
+collection or source never rescans rows. The cube file is reloaded when `collection-query rollup` rewrites it.
+"""
+from analytics.rollup import ALL, RollupCube
+import argparse
+import os
+
+
+class CubeFile:
+    """The cube in a file, loaded again only when the file's modification time changes."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.modified = None
+        self.cube = RollupCube()
+
+    def get(self):
+        modified = os.stat(self.filename).st_mtime if os.path.exists(self.filename) else None
+        if modified != self.modified:
+            self.cube = RollupCube.load(self.filename) if modified is not None else RollupCube()
+            self.modified = modified
+        return self.cube
+
+
+def options(cube, dimension):
+    return [{'label': 'All', 'value': ALL}] + [{'label': member, 'value': member} for member in cube.members(dimension)]
+
+
+def bar_figure(breakdown, title):
+    import plotly.graph_objects as go
+    labels = [member for member, _ in breakdown]
+    views = [views for _, views in breakdown]
+    figure = go.Figure(go.Bar(x=views, y=labels, orientation='h'))
+    figure.update_layout(title=title, yaxis={'autorange': 'reversed'}, height=max(300, 24 * len(labels) + 120))
+    return figure
+
+
+def build_app(cube_file, top=25):
+    from dash import Dash, Input, Output, dcc, html
+    import plotly.graph_objects as go
+    cube = cube_file.get()
+    app = Dash(__name__, title='Collection views')
+    app.layout = html.Div(
+        [
+            html.H1('Collection views'),
+            html.Div(
+                [
+                    dcc.Dropdown(id='collection', options=options(cube, 'collection'), value=ALL, clearable=False),
+                    dcc.Dropdown(id='source', options=options(cube, 'source'), value=ALL, clearable=False),
+                    dcc.Dropdown(id='month', options=options(cube, 'month'), value=ALL, clearable=False),
+                ],
+                style={'display': 'grid', 'gridTemplateColumns': '2fr 1fr 1fr', 'gap': '8px'},
+            ),
+            html.H2(id='total'),
+            dcc.Graph(id='series'),
+            html.Div(
+                [dcc.Graph(id='collections'), dcc.Graph(id='sources')],
+                style={'display': 'grid', 'gridTemplateColumns': '1fr 1fr'},
+            ),
+        ]
+    )
+
+    @app.callback(
+        Output('collection', 'options'),
+        Output('source', 'options'),
+        Output('month', 'options'),
+        Output('total', 'children'),
+        Output('series', 'figure'),
+        Output('collections', 'figure'),
+        Output('sources', 'figure'),
+        Input('collection', 'value'),
+        Input('source', 'value'),
+        Input('month', 'value'),
+    )
+    def refresh(collection, source, month):
+        cube = cube_file.get()
+        series = cube.series(collection, source)
+        figure = go.Figure(go.Scatter(x=[m for m, _ in series], y=[views for _, views in series], mode='lines+markers'))
+        figure.update_layout(title='Views by month', xaxis={'type': 'category'})
+        return (
+            options(cube, 'collection'),
+            options(cube, 'source'),
+            options(cube, 'month'),
+            f"{cube.get(collection, source, month):,} views",
+            figure,
+            bar_figure(cube.breakdown('collection', source=source, month=month, n=top), f'Top {top} collections'),
+            bar_figure(cube.breakdown('source', collection=collection, month=month, n=top), f'Top {top} sources'),
+        )
+
+    @app.callback(Output('collection', 'value'), Input('collections', 'clickData'), prevent_initial_call=True)
+    def drill_collection(click):
+        return click['points'][0]['y']
+
+    @app.callback(Output('source', 'value'), Input('sources', 'clickData'), prevent_initial_call=True)
+    def drill_source(click):
+        return click['points'][0]['y']
+
+    return app
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Serve a dashboard over the rollup cube.')
+    parser.add_argument('--cube', default='datasets/rollup.json', help='Cube file written by the rollup command.')
+    parser.add_argument('--top', type=int, default=25, help='Bars shown in the collection and source charts.')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on.')
+    parser.add_argument('--port', type=int, default=8050, help='Port to listen on.')
+    parser.add_argument('--debug', action='store_true', help='Run Dash in debug mode.')
+    args = parser.parse_args(argv)
+    build_app(CubeFile(args.cube), top=args.top).run(host=args.host, port=args.port, debug=args.debug)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Columnar copies of the generated datasets. Parquet files are zstd compressed and dictionary-encode the repeated
+path and month strings; Arrow IPC files are left uncompressed so that load() can memory-map them without copying.
+"""
+FORMATS = ('csv', 'parquet', 'arrow')
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+BATCH_ROWS = 65536
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet and Arrow output need pyarrow. Install it with: poetry install -E columnar")
+    return pyarrow, pyarrow.parquet
+
+
+def filename_for(stem, fmt):
+    return f"{stem}.{EXTENSIONS.get(fmt, 'csv')}"
+
+
+def long_schema():
+    pa, _ = _pyarrow()
+    return pa.schema(
+        [
+            ('path', pa.string()),
+            ('month', pa.string()),
+            ('views', pa.int64()),
+        ]
+    )
+
+
+def _writer(filename, schema, fmt):
+    pa, pq = _pyarrow()
+    if fmt == 'parquet':
+        return pq.ParquetWriter(filename, schema, compression='zstd')
+    if fmt == 'arrow':
+        return pa.ipc.new_file(filename, schema)
+    raise ValueError(f"Unknown columnar format {fmt!r}; expected one of {FORMATS[1:]}")
+
+
+def write_long(records, filename, fmt='parquet'):
+    """Writes (path, month, views) records in batches, so the whole long table never has to be held at once."""
+    pa, _ = _pyarrow()
+    schema = long_schema()
+    writer = _writer(filename, schema, fmt)
+    batch = {'path': [], 'month': [], 'views': []}
+    try:
+        for path, month, views in records:
+            batch['path'].append(path)
+            batch['month'].append(month)
+            batch['views'].append(views)
+            if len(batch['views']) >= BATCH_ROWS:
+                writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+                batch = {'path': [], 'month': [], 'views': []}
+        if len(batch['views']) > 0:
+            writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+    finally:
+        writer.close()
+
+
+def write_columns(columns, filename, fmt='parquet'):
+    pa, _ = _pyarrow()
+    table = pa.Table.from_pydict(columns)
+    writer = _writer(filename, table.schema, fmt)
+    try:
+        writer.write_table(table)
+    finally:
+        writer.close()
+
+
+def load(filename):
+    """Opens a Parquet or Arrow IPC dataset as a pyarrow Table backed by a memory map."""
+    pa, pq = _pyarrow()
+    if filename.endswith('.parquet'):
+        return pq.read_table(filename, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(filename, 'r')).read_all()
+
+
+def load_dataframe(filename):
+    return load(filename).to_pandas()
@@ -0,0 +1,135 @@
+import datetime
+import threading
+import time
+
+REFERRERS = [
+    ('google', 'google'),
+    ('search.google.com', 'search.google.com'),
+    ('t.co/abc', 't.co'),
+    ('l.facebook.com/', 'l.facebook.com'),
+    ('utk.primo.exlibrisgroup.com/discovery/search', 'utk.primo.exlibrisgroup.com'),
+    ('(direct)', '(direct)'),
+]
+
+
+class FakeReportingService:
+    """
+    Local stand-in for build("analyticsreporting", "v4"). It answers reports().batchGet(body=...).execute() with
+    synthetic, deterministic rows so the pipelines can run without connection.json or network access. Every
+    reportRequest gets `rows` rows, paged by page_size (or the request's own pageSize) and following the
+    request's dimension filter, with `latency` seconds of sleep per call. With rows_per_day set, reports over
+    absolute dates get rows in proportion to the length of their range instead.
+    """
+    def __init__(self, rows=10000, page_size=None, latency=0.0, distinct_paths=5000, sampled=False, rows_per_day=None):
+        self.rows = rows
+        self.rows_per_day = rows_per_day
+        self.page_size = page_size
+        self.latency = latency
+        self.distinct_paths = distinct_paths
+        self.sampled = sampled
+        self.calls = 0
+        self.__lock = threading.Lock()
+
+    def count_call(self):
+        with self.__lock:
+            self.calls += 1
+
+    def reports(self):
+        return self
+
+    def batchGet(self, body):
+        return FakeRequest(self, body)
+
+    def rows_for(self, report_request):
+        if self.rows_per_day is None:
+            return self.rows
+        date_range = report_request['dateRanges'][0]
+        try:
+            start = datetime.date.fromisoformat(date_range['startDate'])
+            end = datetime.date.fromisoformat(date_range['endDate'])
+        except ValueError:
+            return self.rows
+        return self.rows_per_day * ((end - start).days + 1)
+
+    @staticmethod
+    def __filter(report_request):
+        for clause in report_request.get('dimensionFilterClauses', []):
+            for dimension_filter in clause.get('filters', []):
+                return dimension_filter
+        return None
+
+    def __path(self, report_request, i):
+        dimension_filter = self.__filter(report_request)
+        n = i % self.distinct_paths
+        if dimension_filter is None:
+            return f"/media/{n}"
+        expressions = dimension_filter['expressions']
+        if dimension_filter['operator'] == 'BEGINS_WITH':
+            return f"{expressions[0]}/term{n}?type=dismax&cp=collections:c{n % 20}"
+        return expressions[i % len(expressions)]
+
+    def __value(self, name, report_request, i, path):
+        if name in ('ga:pagePath', 'ga:landingPagePath'):
+            return path
+        if name == 'ga:fullReferrer':
+            return REFERRERS[i % len(REFERRERS)][0]
+        if name == 'ga:source':
+            return REFERRERS[i % len(REFERRERS)][1]
+        if name == 'ga:pageTitle':
+            return f"Title {i % self.distinct_paths}"
+        if name == 'ga:yearMonth':
+            return self.__year_month(report_request, i)
+        return str(i)
+
+    @staticmethod
+    def __year_month(report_request, i):
+        date_range = report_request['dateRanges'][0]
+        try:
+            start = datetime.date.fromisoformat(date_range['startDate'])
+            end = datetime.date.fromisoformat(date_range['endDate'])
+        except ValueError:
+            return f"2022{i % 12 + 1:02d}"
+        months = (end.year - start.year) * 12 + end.month - start.month + 1
+        month = start.month - 1 + i % months
+        return f"{start.year + month // 12}{month % 12 + 1:02d}"
+
+    def report(self, report_request):
+        total = self.rows_for(report_request)
+        page_size = self.page_size or report_request.get('pageSize', 1000)
+        start = int(report_request.get('pageToken', 0))
+        end = min(start + page_size, total)
+        names = [dimension['name'] for dimension in report_request.get('dimensions', [])]
+        metrics = len(report_request.get('metrics', []))
+        rows = []
+        for i in range(start, end):
+            path = self.__path(report_request, i)
+            rows.append(
+                {
+                    'dimensions': [self.__value(name, report_request, i, path) for name in names],
+                    'metrics': [{'values': [str(i % 50 + 1)] * metrics}],
+                }
+            )
+        report = {
+            'columnHeader': {'dimensions': names},
+            'data': {'rowCount': total},
+        }
+        if len(rows) > 0:
+            report['data']['rows'] = rows
+        if self.sampled:
+            report['data']['samplesReadCounts'] = [str(total)]
+            report['data']['samplingSpaceSizes'] = [str(total * 10)]
+        if end < total:
+            report['nextPageToken'] = str(end)
+        return report
+
+
+class FakeRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        self.service.count_call()
+        if self.service.latency > 0:
+            time.sleep(self.service.latency)
+        return {'reports': [self.service.report(report_request) for report_request in self.body['reportRequests']]}
@@ -0,0 +1,188 @@
+"""
+Rebuilds the month pivot from the per-month CSVs in final_months/ without querying the API:
+
+    collection-query merge --start 2019-07 --end 2022-07 --output months/final
+
+Each month is sorted by path on its own, in parallel and spilling sorted runs to disk when a month is larger than
+--chunk-rows, and the sorted months are then merged k ways so only one row per month is held at a time.
+"""
+from analytics.cli import load_config
+from analytics.streamer import MonthBuilder, MonthCheckpoints
+from analytics import datasets
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+import argparse
+import csv
+import heapq
+import os
+import tempfile
+
+CHUNK_ROWS = 1000000
+
+
+def read_month(filename):
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for path, views in reader:
+            yield path, int(views)
+
+
+def write_month(pairs, filename):
+    with open(f"{filename}.tmp", 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'views'])
+        writer.writerows(pairs)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def sum_sorted(pairs):
+    """Collapses runs of the same path in sorted (path, views) pairs into one pair with the views summed."""
+    for path, group in groupby(pairs, key=itemgetter(0)):
+        yield path, sum(views for _, views in group)
+
+
+def spill(pairs, directory):
+    handle, filename = tempfile.mkstemp(suffix='.run', dir=directory)
+    os.close(handle)
+    write_month(pairs, filename)
+    return filename
+
+
+def sort_month(source, target, chunk_rows=CHUNK_ROWS):
+    """
+    Writes source sorted by path to target. Months with more than chunk_rows rows are sorted in chunks that are
+    spilled to disk as runs and merged back together.
+    """
+    directory = os.path.dirname(target) or '.'
+    runs = []
+    chunk = []
+    try:
+        for pair in read_month(source):
+            chunk.append(pair)
+            if len(chunk) >= chunk_rows:
+                chunk.sort()
+                runs.append(spill(chunk, directory))
+                chunk = []
+        chunk.sort()
+        if len(runs) == 0:
+            write_month(sum_sorted(chunk), target)
+        else:
+            runs.append(spill(chunk, directory))
+            chunk = []
+            write_month(sum_sorted(heapq.merge(*[read_month(run) for run in runs])), target)
+    finally:
+        for run in runs:
+            os.remove(run)
+    return target
+
+
+def tagged(filename, column):
+    for path, views in read_month(filename):
+        yield path, column, views
+
+
+class MonthFileMerger:
+    """
+    The wide path x month pivot of MonthlyPivot, built by merging sorted per-month files instead of holding every
+    path in memory. Sorted copies are kept in work_dir and only redone when their month's CSV is newer.
+    """
+    def __init__(self, months, directory="final_months", work_dir=None, workers=4, chunk_rows=CHUNK_ROWS):
+        self.checkpoints = MonthCheckpoints(directory)
+        self.work_dir = work_dir or os.path.join(directory, 'sorted')
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.months = [month for month in months if self.checkpoints.has(month)]
+        self.missing = [month for month in months if month not in self.months]
+        self.columns = [month['name'] for month in months]
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def sorted_filename(self, month):
+        return os.path.join(self.work_dir, f"{month['name']}.csv")
+
+    def is_stale(self, month):
+        target = self.sorted_filename(month)
+        source = self.checkpoints.filename(month)
+        return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source)
+
+    def sort(self):
+        """Sorts every month that changed since it was last sorted. Returns the months sorted."""
+        stale = [month for month in self.months if self.is_stale(month)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            list(
+                executor.map(
+                    sort_month,
+                    [self.checkpoints.filename(month) for month in stale],
+                    [self.sorted_filename(month) for month in stale],
+                    [self.chunk_rows] * len(stale),
+                )
+            )
+        return stale
+
+    def __merged(self):
+        streams = [
+            tagged(self.sorted_filename(month), self.columns.index(month['name']))
+            for month in self.months
+        ]
+        return groupby(heapq.merge(*streams), key=itemgetter(0))
+
+    def rows(self):
+        for path, cells in self.__merged():
+            record = {'path': path}
+            for _, column, views in cells:
+                record[self.columns[column]] = views
+            yield record
+
+    def iter_long(self):
+        for path, cells in self.__merged():
+            for _, column, views in cells:
+                yield path, self.columns[column], views
+
+    def write_csv(self, filename):
+        with open(filename, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=['path'] + self.columns)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+    def write(self, stem, fmt='csv'):
+        filename = datasets.filename_for(stem, fmt)
+        if fmt == 'csv':
+            self.write_csv(filename)
+        else:
+            datasets.write_long(self.iter_long(), filename, fmt)
+        return filename
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Rebuild the month pivot from per-month CSVs.')
+    parser.add_argument('--config', default='config.yml', help='Collections and rules file.')
+    parser.add_argument('--start', help='First month to merge as YYYY-MM. Defaults to streamer.start in config.yml.')
+    parser.add_argument('--end', help='Last month to merge as YYYY-MM. Defaults to streamer.end in config.yml.')
+    parser.add_argument('--checkpoints', default='final_months', help='Directory of per-month CSVs.')
+    parser.add_argument('--work-dir', help='Where sorted months are kept (default CHECKPOINTS/sorted).')
+    parser.add_argument('--workers', type=int, default=4, help='Number of months to sort at once.')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Rows sorted in memory before spilling.')
+    parser.add_argument('--output', default='months/final', help='Pivot file name, without extension.')
+    parser.add_argument('--format', choices=datasets.FORMATS, default='csv', help='Output format for the pivot.')
+    args = parser.parse_args(argv)
+    config = load_config(args.config).get('streamer', {})
+    months = MonthBuilder(
+        start=args.start or config.get('start', '2019-07'),
+        end=args.end or config.get('end', '2022-07'),
+    ).months
+    merger = MonthFileMerger(
+        months,
+        directory=args.checkpoints,
+        work_dir=args.work_dir,
+        workers=args.workers,
+        chunk_rows=args.chunk_rows,
+    )
+    for month in merger.missing:
+        print(f'No closed checkpoint for {month["name"]}, leaving its column empty')
+    print(f'Sorted {len(merger.sort())} of {len(merger.months)} months')
+    print(f'Wrote {merger.write(args.output, args.format)}')
+
+
+if __name__ == "__main__":
+    main()
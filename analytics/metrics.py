@@ -0,0 +1,152 @@
+from collections import Counter
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUOTA_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'RESOURCE_EXHAUSTED')
+
+
+def error_status(error):
+    """The HTTP status of a googleapiclient HttpError or aio.ReportingHttpError, or None for other errors."""
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def is_quota_error(error):
+    """A 429, or a 403 whose reason is one of the rate limit or quota reasons rather than a permission error."""
+    status = error_status(error)
+    return status == 429 or (status == 403 and any(reason in str(error) for reason in QUOTA_REASONS))
+
+
+class Metrics:
+    """
+    Counters and timings for one run: per-request latency, pages, rows per page, bytes received, errors (quota
+    errors counted separately) and wall time per pipeline stage. Request events can be streamed to a JSON-lines
+    file as they happen; the totals are exported as a JSON line or Prometheus text at the end of the run.
+    """
+    def __init__(self, events=None, measure_bytes=True):
+        self.measure_bytes = measure_bytes
+        self.__lock = threading.Lock()
+        self.__events = open(events, 'a') if events is not None else None
+        self.requests = 0
+        self.cache_hits = 0
+        self.pages = 0
+        self.rows = 0
+        self.bytes = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = Counter()
+        self.errors = Counter()
+        self.quota_errors = 0
+        self.stages = Counter()
+
+    @classmethod
+    def for_file(cls, filename):
+        """
+        A Metrics whose request events stream to filename, unless it is a Prometheus *.prom file. Without a filename
+        only the cheap counters are kept; bytes received are measured by re-serialising each response.
+        """
+        if filename is None:
+            return cls(measure_bytes=False)
+        if filename.endswith('.prom'):
+            return cls()
+        return cls(events=filename)
+
+    def __event(self, event):
+        if self.__events is not None:
+            self.__events.write(json.dumps(event) + '\n')
+
+    def record_request(self, latency, response, cached=False):
+        reports = response.get('reports', [])
+        rows = [len(report.get('data', {}).get('rows', [])) for report in reports]
+        size = len(json.dumps(response, separators=(',', ':'))) if self.measure_bytes else 0
+        with self.__lock:
+            self.requests += 1
+            self.cache_hits += int(cached)
+            self.pages += len(reports)
+            self.rows += sum(rows)
+            self.bytes += size
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            for bucket in LATENCY_BUCKETS:
+                if latency <= bucket:
+                    self.latency_buckets[bucket] += 1
+            self.__event(
+                {
+                    'event': 'request', 'time': time.time(), 'latency': round(latency, 4), 'cached': cached,
+                    'rows_per_page': rows, 'bytes': size,
+                }
+            )
+
+    def record_error(self, error):
+        status = error_status(error)
+        kind = str(status) if status is not None else type(error).__name__
+        with self.__lock:
+            self.errors[kind] += 1
+            if is_quota_error(error):
+                self.quota_errors += 1
+            self.__event({'event': 'error', 'time': time.time(), 'kind': kind, 'message': str(error)[:200]})
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.stages[name] += time.perf_counter() - start
+
+    def summary(self):
+        with self.__lock:
+            return {
+                'requests': self.requests,
+                'cache_hits': self.cache_hits,
+                'pages': self.pages,
+                'rows': self.rows,
+                'rows_per_page': round(self.rows / self.pages, 1) if self.pages else 0,
+                'bytes': self.bytes,
+                'latency_seconds_total': round(self.latency_total, 3),
+                'latency_seconds_mean': round(self.latency_total / self.requests, 4) if self.requests else 0,
+                'latency_seconds_max': round(self.latency_max, 4),
+                'errors': dict(self.errors),
+                'quota_errors': self.quota_errors,
+                'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            }
+
+    def to_prometheus(self, prefix='collection_query'):
+        summary = self.summary()
+        lines = []
+        for name in ('requests', 'cache_hits', 'pages', 'rows', 'bytes', 'quota_errors'):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {summary[name]}")
+        lines.append(f"# TYPE {prefix}_request_latency_seconds histogram")
+        with self.__lock:
+            for bucket in LATENCY_BUCKETS:
+                lines.append(f'{prefix}_request_latency_seconds_bucket{{le="{bucket}"}} {self.latency_buckets[bucket]}')
+        lines.append(f'{prefix}_request_latency_seconds_bucket{{le="+Inf"}} {summary["requests"]}')
+        lines.append(f"{prefix}_request_latency_seconds_sum {summary['latency_seconds_total']}")
+        lines.append(f"{prefix}_request_latency_seconds_count {summary['requests']}")
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for kind, count in summary['errors'].items():
+            lines.append(f'{prefix}_errors_total{{kind="{kind}"}} {count}')
+        lines.append(f"# TYPE {prefix}_stage_seconds gauge")
+        for name, seconds in summary['stages'].items():
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}"}} {seconds}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """Writes the totals as Prometheus text for *.prom files, otherwise appends them as one JSON line."""
+        if self.__events is not None:
+            self.__events.flush()
+        if filename.endswith('.prom'):
+            with open(filename, 'w') as f:
+                f.write(self.to_prometheus())
+        else:
+            with open(filename, 'a') as f:
+                f.write(json.dumps(dict(self.summary(), event='summary', time=time.time())) + '\n')
+
+    def close(self):
+        if self.__events is not None:
+            self.__events.close()
+            self.__events = None
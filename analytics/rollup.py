@@ -0,0 +1,186 @@
+"""
+Pre-aggregated views by collection x source x month, built from the analytics.py sources output and the streamer.py
+pivot:
+
+    collection-query rollup --sources datasets/sources.csv --streams months/final.csv
+
+Every cell is stored together with its seven wildcard rollups, so a total for any combination of fixed and
+"all" dimensions is a single dict lookup.
+"""
+from analytics.cache import PROCESSING_DAYS
+from analytics import datasets
+from collections import Counter
+import argparse
+import calendar
+import csv
+import datetime
+import json
+import os
+
+ALL = '*'
+DIMENSIONS = ('collection', 'source', 'month')
+STREAM_COLLECTION = 'stream.lib.utk.edu'
+STREAM_SOURCE = '(all sources)'
+MONTH_NAMES = {name[:3]: i for i, name in enumerate(calendar.month_name) if name}
+
+
+def month_key(value):
+    """Turns a ga:yearMonth (202301), an ISO month (2023-01) or a MonthBuilder name (Jan 2023) into 2023-01."""
+    value = str(value).strip()
+    if len(value) == 6 and value.isdigit():
+        return f"{value[:4]}-{value[4:]}"
+    if value[:3] in MONTH_NAMES:
+        return f"{value[-4:]}-{MONTH_NAMES[value[:3]]:02d}"
+    year, month = value.split('-')[:2]
+    return f"{int(year)}-{int(month):02d}"
+
+
+def complete_months(start, end, today=None):
+    """
+    Months, as 2023-01, that start..end covers from first to last day and that GA has finished processing. A
+    rolling range like 365daysago..today only covers part of its first and last months, and those partial totals
+    must not replace complete ones in the cube.
+    """
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=PROCESSING_DAYS)
+    months = set()
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        first = datetime.date(year, month, 1)
+        last = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        if first >= start and last <= end and last < cutoff:
+            months.add(f"{year}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class RollupCube:
+    """
+    Views per (collection, source, month) cell plus every rollup of it with ALL in place of one or more
+    dimensions. Updates set a cell to its new total and push only the difference into its rollups, so loading a
+    re-crawled month again replaces its figures instead of counting them twice.
+    """
+    def __init__(self):
+        self.cells = {}
+        self.totals = Counter()
+        self.__members = {dimension: set() for dimension in DIMENSIONS}
+
+    @staticmethod
+    def __rollups(key):
+        collection, source, month = key
+        for c in (collection, ALL):
+            for s in (source, ALL):
+                for m in (month, ALL):
+                    yield c, s, m
+
+    def __set(self, key, views):
+        delta = views - self.cells.get(key, 0)
+        if key not in self.cells:
+            for dimension, member in zip(DIMENSIONS, key):
+                self.__members[dimension].add(member)
+        self.cells[key] = views
+        if delta != 0:
+            for rollup in self.__rollups(key):
+                self.totals[rollup] += delta
+
+    def set(self, collection, source, month, views):
+        self.__set((collection, source, month_key(month)), views)
+
+    def update(self, records):
+        """
+        Sets cells from (collection, source, month, views) records. Records for the same cell are summed first, so
+        one file's output can be passed as-is. Returns the number of cells set.
+        """
+        batch = Counter()
+        for collection, source, month, views in records:
+            batch[(collection, source, month_key(month))] += int(views)
+        for key, views in batch.items():
+            self.__set(key, views)
+        return len(batch)
+
+    def get(self, collection=ALL, source=ALL, month=ALL):
+        month = month if month == ALL else month_key(month)
+        return self.totals.get((collection, source, month), 0)
+
+    def members(self, dimension):
+        return sorted(self.__members[dimension])
+
+    def series(self, collection=ALL, source=ALL):
+        """(month, views) for every month in the cube, oldest first."""
+        return [(month, self.get(collection, source, month)) for month in self.members('month')]
+
+    def breakdown(self, dimension, collection=ALL, source=ALL, month=ALL, n=None):
+        """Views for each member of dimension with the other two dimensions fixed, largest first."""
+        fixed = {'collection': collection, 'source': source, 'month': month}
+        results = []
+        for member in self.__members[dimension]:
+            fixed[dimension] = member
+            views = self.get(**fixed)
+            if views:
+                results.append((member, views))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:n] if n is not None else results
+
+    def __len__(self):
+        return len(self.cells)
+
+    def save(self, filename):
+        with open(f"{filename}.tmp", 'w') as f:
+            json.dump({'cells': [[*key, views] for key, views in self.cells.items()]}, f)
+        os.replace(f"{filename}.tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        cube = cls()
+        with open(filename) as f:
+            cube.update(json.load(f)['cells'])
+        return cube
+
+
+def read_sources(filename):
+    """(collection, source, month, views) records from the CSV analytics.py writes."""
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row['collection'], row['source'], row['month'], int(row['views'])
+
+
+def read_streams(filename, collection=STREAM_COLLECTION, source=STREAM_SOURCE):
+    """
+    Monthly totals of a streamer.py pivot as records for one collection. The streamer report has no source
+    dimension, so all of its views are filed under a single source.
+    """
+    totals = Counter()
+    if filename.endswith('.csv'):
+        with open(filename, newline='') as f:
+            reader = csv.reader(f)
+            months = next(reader)[1:]
+            for row in reader:
+                for month, views in zip(months, row[1:]):
+                    if views != '':
+                        totals[month] += int(views)
+    else:
+        table = datasets.load(filename)
+        for month, views in zip(table.column('month').to_pylist(), table.column('views').to_pylist()):
+            totals[month] += views
+    for month, views in totals.items():
+        yield collection, source, month, views
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Roll analytics and streamer output up into a cube.')
+    parser.add_argument('--sources', default='datasets/sources.csv', help='Sources CSV written by analytics.py.')
+    parser.add_argument('--streams', default='months/final.csv', help='Pivot written by streamer.py.')
+    parser.add_argument('--cube', default='datasets/rollup.json', help='Cube file to update.')
+    parser.add_argument('--rebuild', action='store_true', help='Start from an empty cube instead of updating.')
+    args = parser.parse_args(argv)
+    cube = RollupCube.load(args.cube) if os.path.exists(args.cube) and not args.rebuild else RollupCube()
+    if os.path.exists(args.sources):
+        print(f'{cube.update(read_sources(args.sources))} cells from {args.sources}')
+    if os.path.exists(args.streams):
+        print(f'{cube.update(read_streams(args.streams))} cells from {args.streams}')
+    os.makedirs(os.path.dirname(args.cube) or '.', exist_ok=True)
+    cube.save(args.cube)
+    print(f'{len(cube)} cells, {cube.get()} views in {args.cube}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+from array import array
+import threading
+
+
+class PathDictionary:
+    """
+    Interns paths to small integer ids so a path seen in every month is stored once. Lookups of known paths take no
+    lock; new paths are added under one so worker threads can share a dictionary.
+    """
+    __slots__ = ('ids', 'paths', '__lock')
+
+    def __init__(self):
+        self.ids = {}
+        self.paths = []
+        self.__lock = threading.Lock()
+
+    def id(self, path):
+        path_id = self.ids.get(path)
+        if path_id is None:
+            with self.__lock:
+                path_id = self.ids.get(path)
+                if path_id is None:
+                    path_id = len(self.paths)
+                    self.paths.append(path)
+                    self.ids[path] = path_id
+        return path_id
+
+    def __getitem__(self, path_id):
+        return self.paths[path_id]
+
+    def __contains__(self, path):
+        return path in self.ids
+
+    def __len__(self):
+        return len(self.paths)
+
+
+class RowStore:
+    """
+    Views per path for one report, as two parallel integer arrays of path ids and views instead of a dict per row.
+    Metrics are parsed to ints once as rows arrive and repeated paths are summed in place. The id to position index
+    used for that is kept while a report's pages are still being added; compact() drops it once the report is
+    complete, and it is only rebuilt if more rows are added after that.
+    """
+    __slots__ = ('dictionary', 'path_ids', 'views', '__positions')
+
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary if dictionary is not None else PathDictionary()
+        self.path_ids = array('l')
+        self.views = array('q')
+        self.__positions = None
+
+    def add(self, path, views):
+        if self.__positions is None:
+            self.__positions = {path_id: position for position, path_id in enumerate(self.path_ids)}
+        path_id = self.dictionary.id(path)
+        position = self.__positions.get(path_id)
+        if position is None:
+            self.__positions[path_id] = len(self.path_ids)
+            self.path_ids.append(path_id)
+            self.views.append(views)
+        else:
+            self.views[position] += views
+
+    def add_rows(self, rows):
+        """Adds API rows whose first dimension is the path and first metric the views."""
+        for row in rows:
+            self.add(row['dimensions'][0], int(row['metrics'][0]['values'][0]))
+        return self
+
+    def compact(self):
+        self.__positions = None
+        return self
+
+    def __len__(self):
+        return len(self.path_ids)
+
+    def __iter__(self):
+        return zip(self.path_ids, self.views)
+
+    def items(self, prefix=''):
+        paths = self.dictionary.paths
+        for path_id, views in zip(self.path_ids, self.views):
+            yield prefix + paths[path_id], views
@@ -0,0 +1,203 @@
+from analytics.metrics import error_status, is_quota_error
+import random
+import threading
+import time
+
+# Reporting API v4 limits: 2,000 requests per 100 seconds per project, 100 requests per 100 seconds per user,
+# 10 concurrent requests per view, 50,000 requests per project per day and 10,000 requests per view per day.
+PROJECT_REQUESTS_PER_100_SECONDS = 2000
+USER_REQUESTS_PER_100_SECONDS = 100
+CONCURRENT_REQUESTS_PER_VIEW = 10
+DAILY_REQUESTS_PER_PROJECT = 50000
+DAILY_REQUESTS_PER_VIEW = 10000
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class QuotaExhausted(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Takes one token if one is available and returns 0, otherwise returns the seconds until the next one."""
+        with self.__lock:
+            self.__refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Takes one token, sleeping until one is available. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            delay = self.take()
+            if delay == 0:
+                return waited
+            self.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self):
+        import asyncio
+        waited = 0.0
+        while True:
+            delay = self.take()
+            if delay == 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def remaining(self):
+        with self.__lock:
+            self.__refill()
+            return int(self.tokens)
+
+
+class RequestScheduler:
+    """
+    Shared by every connection in a run. Each call waits for a token from the per-project and per-user buckets and a
+    slot in its view's concurrency limit, then retries 429, 5xx and quota errors with exponential backoff and full
+    jitter. The daily budgets, for the project and for each view, only count the requests made by this run, not
+    earlier runs the same day, and raise QuotaExhausted once spent. call_async does the same for coroutines on an
+    event loop, waiting with asyncio.sleep instead of blocking the thread.
+    """
+    def __init__(
+            self,
+            project_rate=PROJECT_REQUESTS_PER_100_SECONDS / 100,
+            user_rate=USER_REQUESTS_PER_100_SECONDS / 100,
+            concurrent_per_view=CONCURRENT_REQUESTS_PER_VIEW,
+            daily_limit=DAILY_REQUESTS_PER_PROJECT,
+            daily_limit_per_view=DAILY_REQUESTS_PER_VIEW,
+            max_retries=6,
+            base_delay=1.0,
+            max_delay=64.0,
+            sleep=time.sleep,
+    ):
+        self.project = TokenBucket(project_rate, project_rate * 100, sleep=sleep)
+        self.user = TokenBucket(user_rate, user_rate * 100, sleep=sleep)
+        self.concurrent_per_view = concurrent_per_view
+        self.daily_limit = daily_limit
+        self.daily_limit_per_view = daily_limit_per_view
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.used = 0
+        self.used_by_view = {}
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.__views = {}
+        self.__async_views = {}
+        self.__lock = threading.Lock()
+
+    def __view(self, view_id):
+        with self.__lock:
+            if view_id not in self.__views:
+                self.__views[view_id] = threading.BoundedSemaphore(self.concurrent_per_view)
+            return self.__views[view_id]
+
+    def __async_view(self, view_id):
+        import asyncio
+        if view_id not in self.__async_views:
+            self.__async_views[view_id] = asyncio.BoundedSemaphore(self.concurrent_per_view)
+        return self.__async_views[view_id]
+
+    def __count(self, view_id):
+        with self.__lock:
+            if self.used >= self.daily_limit:
+                raise QuotaExhausted(f"Daily budget of {self.daily_limit} Reporting API requests is spent")
+            used_by_view = self.used_by_view.get(view_id, 0)
+            if used_by_view >= self.daily_limit_per_view:
+                raise QuotaExhausted(
+                    f"Daily budget of {self.daily_limit_per_view} Reporting API requests for view {view_id} is spent"
+                )
+            self.used += 1
+            self.used_by_view[view_id] = used_by_view + 1
+
+    def __throttled(self, waited):
+        with self.__lock:
+            self.throttled_seconds += waited
+
+    def __take(self, view_id):
+        self.__count(view_id)
+        self.__throttled(self.project.acquire() + self.user.acquire())
+
+    async def __take_async(self, view_id):
+        self.__count(view_id)
+        self.__throttled(await self.project.acquire_async() + await self.user.acquire_async())
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return True
+        return error_status(error) in RETRYABLE_STATUSES or is_quota_error(error)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, view_id, send, on_error=None):
+        attempt = 0
+        while True:
+            self.__take(view_id)
+            try:
+                with self.__view(view_id):
+                    return send()
+            except Exception as error:
+                if on_error is not None:
+                    on_error(error)
+                if attempt >= self.max_retries or not self.is_retryable(error):
+                    raise
+            self.sleep(self.backoff(attempt))
+            attempt += 1
+            with self.__lock:
+                self.retries += 1
+
+    async def call_async(self, view_id, send, on_error=None):
+        import asyncio
+        attempt = 0
+        while True:
+            await self.__take_async(view_id)
+            try:
+                async with self.__async_view(view_id):
+                    return await send()
+            except Exception as error:
+                if on_error is not None:
+                    on_error(error)
+                if attempt >= self.max_retries or not self.is_retryable(error):
+                    raise
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+            with self.__lock:
+                self.retries += 1
+
+    def remaining(self):
+        """Tokens left in the rate buckets, and requests this run made and may still make within the daily limits."""
+        with self.__lock:
+            used, retries, throttled = self.used, self.retries, self.throttled_seconds
+            used_by_view = dict(self.used_by_view)
+        return {
+            'project_tokens': self.project.remaining(),
+            'user_tokens': self.user.remaining(),
+            'requests_this_run': used,
+            'daily_requests_left_this_run': self.daily_limit - used,
+            'view_requests_left_this_run': {
+                view_id: self.daily_limit_per_view - count for view_id, count in used_by_view.items()
+            },
+            'retries': retries,
+            'throttled_seconds': round(throttled, 2),
+        }
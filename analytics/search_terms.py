@@ -1,82 +1,84 @@
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
+from analytics.cache import ResponseCache
+from analytics.cli import add_connection_arguments
+from analytics.connection import ReportingConnection
+from analytics.metrics import Metrics
+from analytics.scheduler import RequestScheduler
+from analytics.sharding import DateRangeSharder
+from analytics import datasets
+from bisect import bisect_left
+from collections import Counter
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+import argparse
 import csv
+import heapq
 import json
+import os
+import re
+import sqlite3
+import textwrap
+from urllib.parse import unquote
 
+SEARCH_PATH = 'digital.lib.utk.edu/collections/islandora/search/'
 
-class AnalyticsConnection:
-    def __init__(
-            self,
-            credentials,
-            view_id,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-    ):
-        self.credentials_location = credentials
-        self.view_id = view_id
-        self.scopes = scopes
-        self.results = []
-        self.connection = self.__connect()
-
-    def __connect(self):
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            self.credentials_location, self.scopes
-        )
-        return build("analyticsreporting", "v4", credentials=credentials)
 
-    def find_pages(self, page=None, token=None, start_date="45daysAgo", end_date="today"):
+class AnalyticsConnection(ReportingConnection):
+    def build_request(self, page=None, token=None, start_date="45daysAgo", end_date="today"):
         request = {
-            "reportRequests": [
+            "viewId": self.view_id,
+            "dateRanges": [
+                {"startDate": start_date, "endDate": end_date}
+            ],
+            "metrics": [{"expression": "ga:uniquePageviews"}],
+            "dimensions": [{"name": "ga:pagePath"}],
+            "pageSize": 70000,
+            "dimensionFilterClauses": [
                 {
-                    "viewId": self.view_id,
-                    "dateRanges": [
-                        {"startDate": start_date, "endDate": end_date}
-                    ],
-                    "metrics": [{"expression": "ga:uniquePageviews"}],
-                    "dimensions": [{"name": "ga:pagePath"}],
-                    "pageSize": 70000,
-                    "dimensionFilterClauses": [
+                    "filters": [
                         {
-                            "filters": [
-                                {
-                                    "operator": "BEGINS_WITH",
-                                    "dimensionName": "ga:pagePath",
-                                    "expressions": [
-                                        page
-                                    ]
-                                }
+                            "operator": "BEGINS_WITH",
+                            "dimensionName": "ga:pagePath",
+                            "expressions": [
+                                page
                             ]
                         }
-                    ],
+                    ]
                 }
-            ]
+            ],
         }
         if token is not None:
-            request['reportRequests'][0]['pageToken'] = str(token)
-        return (
-            self.connection.reports()
-            .batchGet(
-                body=request
-            )
-            .execute()
+            request['pageToken'] = str(token)
+        return request
+
+    def find_pages(self, page=None, token=None, start_date="45daysAgo", end_date="today"):
+        return self.execute(
+            {
+                "reportRequests": [
+                    self.build_request(page, token=token, start_date=start_date, end_date=end_date)
+                ]
+            }
         )
 
-    def process_pages(self, page, initial_pages=None, start_date=None, end_date=None):
-        if initial_pages is None and start_date is not None and end_date is not None:
-            current_set = self.find_pages(page, start_date=start_date, end_date=end_date)
-        elif initial_pages is None:
-            current_set = self.find_pages()
-        else:
-            current_set = initial_pages
-        try:
-            for view in current_set['reports'][0]['data']['rows']:
-                self.results.append(view)
-        except KeyError:
-            pass
-        if 'nextPageToken' in current_set['reports'][0]:
-            new_request = self.find_pages(token=current_set['reports'][0]['nextPageToken'])
-            return self.process_pages(new_request)
-        else:
+    def iter_rows(self, page, start_date="45daysAgo", end_date="today"):
+        return self.iter_report_rows(self.build_request(page, start_date=start_date, end_date=end_date))
+
+    def iter_row_batches(self, page, start_date="45daysAgo", end_date="today", sharder=None, batch_size=10000):
+        request = self.build_request(page, start_date=start_date, end_date=end_date)
+        if sharder is None:
+            for report in self.iter_report_pages(request):
+                yield report.get('data', {}).get('rows', [])
             return
+        rows = sharder.iter_rows(request)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
+
+    def process_pages(self, page, start_date="45daysAgo", end_date="today"):
+        self.results = list(self.iter_rows(page, start_date=start_date, end_date=end_date))
+        return self.results
 
 
 class SearchTerm:
@@ -118,7 +120,7 @@ class SearchTerm:
 
     def build_results(self):
         return {
-            'search_term': self.find_search_term(),
+            'search_term': self.search_term,
             'collection': self.find_collection_if_exists(),
             'facets': self.find_solr_search_navigation(),
             'full_string': [self.url],
@@ -126,6 +128,57 @@ class SearchTerm:
         }
 
 
+class SearchTermParser:
+    """
+    Parses a page of ga:pagePath values into the same fields as SearchTerm.results, returned as parallel lists.
+    This is still one pass per path: each path is split once with bounded splits and the collection is read with a
+    compiled pattern, which saves SearchTerm's object and repeated full splits but not the per-path loop. Paths with
+    fewer than five segments have no search term and get None.
+    """
+    COLLECTION = re.compile(r'&cp=([^&]*)')
+
+    def parse_one(self, url):
+        segments = url.split('/', 5)
+        if len(segments) < 5:
+            return None, None, None, []
+        search_term = segments[4].split('?', 1)[0].split('&f', 1)[0]
+        position = url.find(SEARCH_PATH)
+        if position == -1:
+            kind = 'browse_and_pagination'
+        elif url.startswith('utk_mods_', position + len(SEARCH_PATH)):
+            kind = 'facet'
+        else:
+            kind = 'search_term'
+        collection = None
+        if '&cp' in url:
+            match = self.COLLECTION.search(url)
+            collection = match.group(1) if match else None
+        facets = []
+        if '&islandora_solr_search_navigation=' in url:
+            for field in url.split('&f[')[1:]:
+                parts = field.split('=', 2)
+                if len(parts) > 1 and parts[1] != "":
+                    facets.append(parts[1])
+        return search_term, kind, collection, facets
+
+    def parse(self, urls):
+        columns = {'full_string': [], 'search_term': [], 'type': [], 'collection': [], 'facets': []}
+        full_strings = columns['full_string'].append
+        search_terms = columns['search_term'].append
+        kinds = columns['type'].append
+        collections = columns['collection'].append
+        facets = columns['facets'].append
+        parse_one = self.parse_one
+        for url in urls:
+            search_term, kind, collection, facet = parse_one(url)
+            full_strings(url)
+            search_terms(search_term)
+            kinds(kind)
+            collections(collection)
+            facets(facet)
+        return columns
+
+
 class SearchTermSorter:
     def __init__(self, terms):
         self.__terms = terms
@@ -134,53 +187,309 @@ class SearchTermSorter:
         return sorted(self.__terms.items(), key=lambda x:x[1]['values'], reverse=True)
 
 
-if __name__ == "__main__":
-    import yaml
-    connection = AnalyticsConnection(
-        credentials="connection.json",
-        view_id="118513499",
-    )
-    page = "digital.lib.utk.edu/collections/islandora/search"
-    connection.process_pages(page=page, start_date='365daysago', end_date='today',)
-    results = connection.results
-    search_terms = {}
-    for result in results:
-        if len(result['dimensions'][0].split('/')) >= 5:
-            search_term = SearchTerm(result['dimensions'][0]).results
-            if search_term['search_term'] != '' and search_term['type'] == 'search_term' and search_term['search_term'] not in search_terms:
-                search_terms[search_term['search_term']] = {
-                    'values': int(result['metrics'][0]['values'][0]),
-                    'collections': [],
-                    'facets': search_term['facets'],
-                    'searches': search_term['full_string']
-                }
-                if search_term['collection'] is not None:
-                    search_terms[search_term['search_term']]['collections'].append(search_term['collection'])
-            elif search_term['search_term'] != '' and search_term['type'] == 'search_term':
-                search_terms[search_term['search_term']]['values'] += int(result['metrics'][0]['values'][0])
-                search_terms[search_term['search_term']]['searches'].append(search_term['full_string'][0])
-                if search_term['collection'] is not None and search_term['collection'] not in search_terms[search_term['search_term']]['collections']:
-                    search_terms[search_term['search_term']]['collections'].append(search_term['collection'])
-                if len(search_term['facets']) > 0:
-                    for facet in search_term['facets']:
-                        if facet not in search_terms[search_term['search_term']]['facets']:
-                            search_terms[search_term['search_term']]['facets'].append(facet)
+def normalize_term(term):
+    """Percent-decodes, case-folds and collapses whitespace, so Knoxville, knoxville and knoxville%20 are one term."""
+    return ' '.join(unquote(term).casefold().split())
+
+
+class TopK:
+    """
+    The k largest counts seen so far. Counts only ever grow, so a term's position can only improve: the current
+    members live in a dict and a min-heap of (count, term) finds the weakest one, skipping entries that went stale
+    when a member's count changed.
+    """
+    def __init__(self, k):
+        self.k = k
+        self.members = {}
+        self.__heap = []
+
+    def __weakest(self):
+        while self.__heap:
+            count, term = self.__heap[0]
+            if self.members.get(term) == count:
+                return count, term
+            heapq.heappop(self.__heap)
+        return None
+
+    def update(self, term, count):
+        if term in self.members or len(self.members) < self.k:
+            self.members[term] = count
+            heapq.heappush(self.__heap, (count, term))
         else:
-            facet = result['dimensions'][0].split('=')[-1]
-            if facet == '0':
-                #print(result['dimensions'][0])
-                pass
-    final = SearchTermSorter(search_terms).sort()
-    with open('datasets/search_terms/basic.csv', 'w') as basic:
-        writer = csv.DictWriter(basic, fieldnames=['search_term', 'total'])
-        writer.writeheader()
-        for k, v in final:
-            writer.writerow(
-                {
-                    'search_term': k,
-                    'total': v['values']
-                }
+            weakest = self.__weakest()
+            if weakest is None or count <= weakest[0]:
+                return
+            heapq.heappop(self.__heap)
+            del self.members[weakest[1]]
+            self.members[term] = count
+            heapq.heappush(self.__heap, (count, term))
+        if len(self.__heap) > 4 * self.k:
+            self.__heap = [(count, term) for term, count in self.members.items()]
+            heapq.heapify(self.__heap)
+
+    def top(self, n=None):
+        return heapq.nlargest(n or self.k, self.members.items(), key=itemgetter(1))
+
+
+class SearchTermIndex:
+    """
+    Counts per normalized search term, overall and per collection, with a running top-k for each so "top 50 terms
+    in collection X" is read straight off a precomputed structure. Prefix queries bisect a sorted list of terms that
+    is rebuilt only after new terms arrive.
+    """
+    def __init__(self, k=50):
+        self.k = k
+        self.counts = Counter()
+        self.by_collection = {}
+        self.__top = TopK(k)
+        self.__collection_tops = {}
+        self.__sorted = []
+        self.__stale = False
+
+    def add(self, term, views, collection=None):
+        if term not in self.counts:
+            self.__stale = True
+        self.counts[term] += views
+        self.__top.update(term, self.counts[term])
+        if collection is not None:
+            if collection not in self.by_collection:
+                self.by_collection[collection] = Counter()
+                self.__collection_tops[collection] = TopK(self.k)
+            counts = self.by_collection[collection]
+            counts[term] += views
+            self.__collection_tops[collection].update(term, counts[term])
+
+    def top(self, n=None, collection=None):
+        n = n or self.k
+        counts = self.counts if collection is None else self.by_collection.get(collection, Counter())
+        if n <= self.k:
+            top = self.__top if collection is None else self.__collection_tops.get(collection)
+            return top.top(n) if top is not None else []
+        return heapq.nlargest(n, counts.items(), key=itemgetter(1))
+
+    def prefix(self, prefix, n=None, collection=None):
+        if self.__stale:
+            self.__sorted = sorted(self.counts)
+            self.__stale = False
+        prefix = normalize_term(prefix)
+        counts = self.counts if collection is None else self.by_collection.get(collection, Counter())
+        matches = []
+        for term in self.__sorted[bisect_left(self.__sorted, prefix):]:
+            if not term.startswith(prefix):
+                break
+            if term in counts:
+                matches.append((term, counts[term]))
+        return heapq.nlargest(n or self.k, matches, key=itemgetter(1))
+
+    def collections(self):
+        return list(self.by_collection)
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'k': self.k, 'terms': self.counts, 'collections': self.by_collection}, f)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            saved = json.load(f)
+        index = cls(k=saved['k'])
+        for collection, counts in saved['collections'].items():
+            for term, views in counts.items():
+                index.add(term, views, collection)
+        # Views with no collection are whatever the per-collection totals do not account for.
+        for term, views in saved['terms'].items():
+            remainder = views - index.counts[term]
+            if remainder > 0:
+                index.add(term, remainder)
+        return index
+
+
+class SpilledSearches:
+    """
+    The distinct search URLs of every term, kept in a temporary SQLite database instead of in memory. Inserts are
+    buffered and appended in batches without any index; the first get() indexes the table by term once, and each
+    get() then reads one term's distinct URLs back in the order they were first added.
+    """
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+        self.__pending = []
+        self.__indexed = False
+        self.__db = sqlite3.connect('')
+        self.__db.execute("CREATE TABLE searches (id INTEGER PRIMARY KEY, term TEXT NOT NULL, search TEXT NOT NULL)")
+
+    def add(self, term, search):
+        self.__pending.append((term, search))
+        if len(self.__pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.__db.executemany("INSERT INTO searches (term, search) VALUES (?, ?)", self.__pending)
+        self.__pending = []
+
+    def get(self, term):
+        if self.__pending:
+            self.flush()
+        if not self.__indexed:
+            self.__db.execute("CREATE INDEX searches_term ON searches (term)")
+            self.__indexed = True
+        rows = self.__db.execute(
+            "SELECT search FROM searches WHERE term = ? GROUP BY search ORDER BY MIN(id)", (term,)
+        )
+        return [search for search, in rows]
+
+    def close(self):
+        self.__db.close()
+
+
+class SearchTermAggregator:
+    """
+    Running totals per normalized search term. Views are counted in a SearchTermIndex and collections and facets
+    kept in insertion-ordered dicts used as sets, so repeated values cost a hash lookup. The raw search URLs, which
+    are most of the data, are spilled to disk with SpilledSearches. Terms can be ranked with a heap for top-n output,
+    and both output files are written one term at a time.
+    """
+    def __init__(self, keep_searches=True, k=50):
+        self.keep_searches = keep_searches
+        self.index = SearchTermIndex(k=k)
+        self.values = self.index.counts
+        self.collections = {}
+        self.facets = {}
+        self.searches = SpilledSearches() if keep_searches else None
+
+    def add(self, term, views, collection=None, facets=(), full_string=None):
+        term = normalize_term(term)
+        if term == '':
+            return
+        if term not in self.values:
+            self.collections[term] = {}
+            self.facets[term] = {}
+        self.index.add(term, views, collection)
+        if collection is not None:
+            self.collections[term][collection] = None
+        for facet in facets:
+            self.facets[term][facet] = None
+        if self.keep_searches and full_string is not None:
+            self.searches.add(term, full_string)
+
+    def add_parsed(self, rows, parsed):
+        for i, result in enumerate(rows):
+            term = parsed['search_term'][i]
+            if term is None or term == '' or parsed['type'][i] != 'search_term':
+                continue
+            self.add(
+                term,
+                int(result['metrics'][0]['values'][0]),
+                collection=parsed['collection'][i],
+                facets=parsed['facets'][i],
+                full_string=parsed['full_string'][i],
             )
-    json_object = json.dumps(final, indent=4)
-    with open("datasets/search_terms/full.json", "w") as outfile:
-        outfile.write(json_object)
+
+    def __len__(self):
+        return len(self.values)
+
+    def top(self, n=None):
+        if n is None:
+            return sorted(self.values.items(), key=itemgetter(1), reverse=True)
+        return self.index.top(n)
+
+    def items(self, n=None):
+        for term, views in self.top(n):
+            yield term, {
+                'values': views,
+                'collections': list(self.collections[term]),
+                'facets': list(self.facets[term]),
+                'searches': self.searches.get(term) if self.keep_searches else [],
+            }
+
+    def close(self):
+        if self.searches is not None:
+            self.searches.close()
+
+    def columns(self, n=None):
+        columns = {'search_term': [], 'total': [], 'collections': [], 'facets': [], 'searches': []}
+        for term, record in self.items(n):
+            columns['search_term'].append(term)
+            columns['total'].append(record['values'])
+            columns['collections'].append(record['collections'])
+            columns['facets'].append(record['facets'])
+            columns['searches'].append(record['searches'])
+        return columns
+
+    def write_csv(self, filename, n=None):
+        with open(filename, 'w') as basic:
+            writer = csv.DictWriter(basic, fieldnames=['search_term', 'total'])
+            writer.writeheader()
+            for term, views in self.top(n):
+                writer.writerow(
+                    {
+                        'search_term': term,
+                        'total': views
+                    }
+                )
+
+    def write_json(self, filename, n=None):
+        """Writes the same document as json.dumps(list(self.items()), indent=4), one term at a time."""
+        with open(filename, 'w') as outfile:
+            outfile.write('[')
+            separator = '\n'
+            for item in self.items(n):
+                outfile.write(separator)
+                outfile.write(textwrap.indent(json.dumps(list(item), indent=4), '    '))
+                separator = ',\n'
+            outfile.write('\n]' if separator != '\n' else ']')
+
+
+def main(argv=None, prog=None, service=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Search terms used on digital.lib.utk.edu.')
+    add_connection_arguments(parser, view_id="118513499")
+    parser.add_argument('--page', default="digital.lib.utk.edu/collections/islandora/search", help='Search path prefix.')
+    parser.add_argument('--start-date', default='365daysago', help='First day of the report.')
+    parser.add_argument('--end-date', default='today', help='Last day of the report.')
+    parser.add_argument('--output-dir', default='datasets/search_terms', help='Where basic.csv and full.json go.')
+    parser.add_argument('--top', type=int, help='Only write the N most viewed search terms.')
+    parser.add_argument('--no-searches', action='store_true', help='Leave the raw search URLs out of full.json.')
+    parser.add_argument('--format', choices=datasets.FORMATS, default='csv', help='Also write a columnar copy.')
+    parser.add_argument('--shard-days', type=int, help='Split the date range into shards of this many days.')
+    parser.add_argument('--shard-workers', type=int, default=4, help='Number of shards to fetch at once.')
+    args = parser.parse_args(argv)
+    metrics = Metrics.for_file(args.metrics)
+    request_scheduler = RequestScheduler()
+    connect = partial(
+        AnalyticsConnection,
+        credentials=args.credentials,
+        view_id=args.view_id,
+        cache=None if args.no_cache else ResponseCache(args.cache_file),
+        service=service,
+        metrics=metrics,
+        scheduler=request_scheduler,
+    )
+    connection = connect()
+    sharder = None
+    if args.shard_days:
+        sharder = DateRangeSharder(connect, shard_days=args.shard_days, workers=args.shard_workers)
+    search_parser = SearchTermParser()
+    search_terms = SearchTermAggregator(keep_searches=not args.no_searches)
+    with metrics.stage('collect'):
+        for rows in connection.iter_row_batches(
+                args.page, start_date=args.start_date, end_date=args.end_date, sharder=sharder
+        ):
+            search_terms.add_parsed(rows, search_parser.parse([row['dimensions'][0] for row in rows]))
+    with metrics.stage('write'):
+        search_terms.write_csv(os.path.join(args.output_dir, 'basic.csv'), n=args.top)
+        search_terms.write_json(os.path.join(args.output_dir, 'full.json'), n=args.top)
+        search_terms.index.save(os.path.join(args.output_dir, 'index.json'))
+        if args.format != 'csv':
+            datasets.write_columns(
+                search_terms.columns(n=args.top),
+                datasets.filename_for(os.path.join(args.output_dir, 'full'), args.format),
+                args.format,
+            )
+    search_terms.close()
+    print(f'Quota (daily budgets count this run only): {request_scheduler.remaining()}')
+    if args.metrics is not None:
+        metrics.write(args.metrics)
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,82 @@
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
+from analytics.aio import AsyncReportingConnection
+from analytics.cache import PROCESSING_DAYS, ResponseCache
+from analytics.cli import add_connection_arguments, load_config
+from analytics.connection import ReportingConnection, thread_local_connection
+from analytics.metrics import Metrics
+from analytics.scheduler import CONCURRENT_REQUESTS_PER_VIEW, RequestScheduler
+from analytics.rows import PathDictionary, RowStore
+from analytics import datasets
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import argparse
+import calendar
 import csv
 import datetime
+import os
 
+STREAM_HOST = "https://stream.lib.utk.edu"
 
-class AnalyticsConnection:
-    def __init__(
-            self,
-            credentials,
-            view_id,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-    ):
-        self.credentials_location = credentials
-        self.view_id = view_id
-        self.scopes = scopes
-        self.results = []
-        self.connection = self.__connect()
 
-    def __connect(self):
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            self.credentials_location, self.scopes
-        )
-        return build("analyticsreporting", "v4", credentials=credentials)
-
-    def find_pages(self, token=None, start_date="45daysAgo", end_date="today"):
-        print(start_date)
-        print(end_date)
+class StreamRequests:
+    """
+    Report requests for the monthly stream.lib.utk.edu pivot, shared by AnalyticsConnection and
+    AsyncAnalyticsConnection. find_pages and iter_rows return whatever execute and iter_report_rows return on the
+    connection they are mixed into.
+    """
+    def build_request(self, token=None, start_date="45daysAgo", end_date="today"):
         request = {
-            "reportRequests": [
-                {
-                    "viewId": self.view_id,
-                    "dateRanges": [
-                        {"startDate": start_date, "endDate": end_date}
-                    ],
-                    "metrics": [{"expression": "ga:uniquePageviews"}],
-                    "dimensions": [{"name": "ga:pagePath"}],
-                    "pageSize": 10000,
-                }
-            ]
+            "viewId": self.view_id,
+            "dateRanges": [
+                {"startDate": start_date, "endDate": end_date}
+            ],
+            "metrics": [{"expression": "ga:uniquePageviews"}],
+            "dimensions": [{"name": "ga:pagePath"}],
+            "pageSize": 10000,
         }
         if token is not None:
-            request['reportRequests'][0]['pageToken'] = str(token)
-        return (
-            self.connection.reports()
-            .batchGet(
-                body=request
-            )
-            .execute()
+            request['pageToken'] = str(token)
+        return request
+
+    def find_pages(self, token=None, start_date="45daysAgo", end_date="today"):
+        return self.execute(
+            {
+                "reportRequests": [
+                    self.build_request(token=token, start_date=start_date, end_date=end_date)
+                ]
+            }
         )
 
-    def process_pages(self, initial_pages=None, start_date=None, end_date=None):
-        if initial_pages is None and start_date is not None and end_date is not None:
-            current_set = self.find_pages( start_date=start_date, end_date=end_date)
-        elif initial_pages is None:
-            current_set = self.find_pages()
-        else:
-            current_set = initial_pages
-        try:
-            for view in current_set['reports'][0]['data']['rows']:
-                self.results.append(view)
-                print(view)
-        except KeyError:
-            pass
-        if 'nextPageToken' in current_set['reports'][0]:
-            new_request = self.find_pages(token=current_set['reports'][0]['nextPageToken'])
-            return self.process_pages(new_request)
-        else:
-            return
+    def iter_rows(self, start_date="45daysAgo", end_date="today"):
+        return self.iter_report_rows(self.build_request(start_date=start_date, end_date=end_date))
+
+
+class AnalyticsConnection(StreamRequests, ReportingConnection):
+    def process_pages(self, start_date="45daysAgo", end_date="today"):
+        self.results = list(self.iter_rows(start_date=start_date, end_date=end_date))
+        return self.results
+
+
+class AsyncAnalyticsConnection(StreamRequests, AsyncReportingConnection):
+    async def process_pages(self, start_date="45daysAgo", end_date="today"):
+        self.results = [row async for row in self.iter_rows(start_date=start_date, end_date=end_date)]
+        return self.results
+
 
 class MonthBuilder:
-    def __init__(self):
+    def __init__(self, start="2019-07", end="2022-07"):
+        self.start = start
+        self.end = end
         self.months = self.__build()
 
+    @staticmethod
+    def __parse(value):
+        year, month = str(value).split('-')[:2]
+        return int(year), int(month)
+
     def __build(self):
-        start_year = 2019
-        start_month = 7
-        end_year = 2022
-        end_month = 7
+        start_year, start_month = self.__parse(self.start)
+        end_year, end_month = self.__parse(self.end)
         months = []
         for year in range(start_year, end_year + 1):
             start_month_range = start_month if year == start_year else 1
@@ -91,83 +91,299 @@ class MonthBuilder:
 
 
 class Crawler:
-    def __init__(self, current_month):
+    def __init__(self, current_month, connection=None, dictionary=None, results=None):
         self.current_month = current_month
-        self.current_results = self.get_results()
+        self.connection = connection
+        self.dictionary = dictionary
+        self.current_results = results if results is not None else self.get_results()
 
     def __crawl(self):
-        connection = AnalyticsConnection(
-            credentials="connection.json",
-            view_id="42472462",
-        )
-        connection.process_pages(start_date=self.current_month['start'], end_date=self.current_month['end'])
-        return connection.results
+        connection = self.connection
+        if connection is None:
+            connection = AnalyticsConnection(
+                credentials="connection.json",
+                view_id="42472462",
+            )
+        return connection.iter_rows(start_date=self.current_month['start'], end_date=self.current_month['end'])
 
     def get_results(self):
-        results = self.__crawl()
-        print(results)
-        current_results = []
-        if self.current_month['name'] == 'Jun 2022':
-            with open('mark.txt', 'w') as f:
-                f.write(str(results))
-        for result in results:
-            path = f"https://stream.lib.utk.edu{result['dimensions'][0]}"
-            matching_dict = next((d for d in current_results if d['path'] == path), None)
-            if matching_dict:
-                if 'views' not in matching_dict:
-                    matching_dict['views'] = 0
-                matching_dict['views'] = matching_dict['views'] + int(result['metrics'][0]['values'][0])
-            else:
-                current_results.append({'path': path, 'views': int(result['metrics'][0]['values'][0])})
-        return current_results
+        return RowStore(self.dictionary).add_rows(self.__crawl()).compact()
 
-    def write_results(self):
-        with open(f"final_months/{self.current_month['name']}.csv", 'w') as f:
+    def write_results(self, directory="final_months"):
+        filename = os.path.join(directory, f"{self.current_month['name']}.csv")
+        with open(f"{filename}.tmp", 'w') as f:
             fieldnames = ['path', 'views']
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
-            for result in self.current_results:
-                writer.writerow(result)
+            for path, views in self.current_results.items(prefix=STREAM_HOST):
+                writer.writerow({'path': path, 'views': views})
+        os.replace(f"{filename}.tmp", filename)
 
 
-if __name__ == "__main__":
-    import calendar
-    final_results = []
-    final = {}
-    months = MonthBuilder().months
-    for month in months:
-        # x = Crawler(month)
-        # x.write_results()
-        connection = AnalyticsConnection(
+class MonthCheckpoints:
+    """
+    Completed months kept as the per-month CSVs Crawler.write_results produces. Only closed months are saved, and a
+    checkpoint is only trusted if its file was written after the month closed, so counts saved while a month was
+    still open are crawled again instead of being kept for good.
+    """
+    def __init__(self, directory="final_months"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, month):
+        return os.path.join(self.directory, f"{month['name']}.csv")
+
+    @staticmethod
+    def is_closed(month, today=None):
+        cutoff = (today or datetime.date.today()) - datetime.timedelta(days=PROCESSING_DAYS)
+        return datetime.date.fromisoformat(month['end']) < cutoff
+
+    def has(self, month):
+        filename = self.filename(month)
+        if not os.path.exists(filename):
+            return False
+        written = datetime.date.fromtimestamp(os.path.getmtime(filename))
+        return self.is_closed(month, today=written)
+
+    def load(self, month):
+        """Yields (path, views) with the stream.lib.utk.edu host the CSVs carry removed again."""
+        with open(self.filename(month), newline='') as f:
+            for row in csv.DictReader(f):
+                path = row['path']
+                if path.startswith(STREAM_HOST):
+                    path = path[len(STREAM_HOST):]
+                yield path, int(row['views'])
+
+    def save(self, crawler):
+        """Saves the crawler's month if it is closed. Returns whether it was saved."""
+        if not self.is_closed(crawler.current_month):
+            return False
+        crawler.write_results(self.directory)
+        return True
+
+
+class CrawlScheduler:
+    """
+    Crawls months on a thread pool. Each worker thread authenticates once and reuses its AnalyticsConnection for
+    every month it picks up; the http client underneath is not safe to share between threads.
+    """
+    def __init__(
+            self,
             credentials="connection.json",
             view_id="42472462",
+            workers=4,
+            cache=None,
+            service=None,
+            metrics=None,
+            scheduler=None,
+            dictionary=None,
+    ):
+        self.credentials = credentials
+        self.view_id = view_id
+        self.workers = workers
+        self.cache = cache
+        self.service = service
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.dictionary = dictionary if dictionary is not None else PathDictionary()
+        self.__connection = thread_local_connection(
+            partial(
+                AnalyticsConnection,
+                credentials=credentials,
+                view_id=view_id,
+                cache=cache,
+                service=service,
+                metrics=metrics,
+                scheduler=scheduler,
+            )
         )
-        print(f'Getting {month["name"]}\n\n')
-        connection.process_pages(start_date=month['start'], end_date=month['end'])
-        results = connection.results
-        for result in results:
-            path = f"https://stream.lib.utk.edu{result['dimensions'][0]}"
-            matching_dict = next((d for d in final_results if d['path'] == path), None)
-            if matching_dict:
-                if month['name'] not in matching_dict:
-                    matching_dict[month['name']] = 0
-                if matching_dict.get(month['name']):
-                    test = month['name']
-                    matching_dict[test] = matching_dict[test] + int(result['metrics'][0]['values'][0])
-                else:
-                    matching_dict[month['name']] = int(result['metrics'][0]['values'][0])
-                    matching_dict[month['name']] = 0
-                    matching_dict[month['name']] += int(result['metrics'][0]['values'][0])
-            else:
-                final_results.append({'path': path, month['name']: int(result['metrics'][0]['values'][0])})
-    with open(f"months/final.csv", 'w') as f:
-        fieldnames = ['path']
+
+    def __crawl(self, month):
+        return Crawler(month, connection=self.__connection(), dictionary=self.dictionary)
+
+    def crawl(self, months):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.__crawl, month) for month in months]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+class AsyncCrawlScheduler:
+    """
+    Crawls every month from one event loop. Each month's pages are folded into its RowStore as they arrive, so only
+    the pages in flight are held as raw JSON.
+    """
+    def __init__(self, connection, dictionary=None):
+        self.connection = connection
+        self.dictionary = dictionary if dictionary is not None else PathDictionary()
+
+    async def __crawl(self, month):
+        store = RowStore(self.dictionary)
+        request = self.connection.build_request(start_date=month['start'], end_date=month['end'])
+        async for report in self.connection.iter_report_pages(request):
+            store.add_rows(report.get('data', {}).get('rows', []))
+        return Crawler(month, dictionary=self.dictionary, results=store.compact())
+
+    async def crawl(self, months, done):
+        """Calls done(crawler) for each month as it completes."""
+        import asyncio
+        async with self.connection:
+            for crawl in asyncio.as_completed([self.__crawl(month) for month in months]):
+                done(await crawl)
+
+
+class MonthlyPivot:
+    """
+    Path x month view counts. Rows are the path ids of a PathDictionary, shared with the crawlers so their RowStores
+    can be added by id, and the counts live in one flat integer array of rows x months. The host prefix is only
+    added to paths on output.
+    """
+    def __init__(self, months, dictionary=None, prefix=''):
+        self.months = [month['name'] for month in months]
+        self.month_index = {name: i for i, name in enumerate(self.months)}
+        self.dictionary = dictionary if dictionary is not None else PathDictionary()
+        self.prefix = prefix
+        self.views = array('q')
+        self.seen = bytearray()
+
+    def add_id(self, path_id, month_name, views):
+        width = len(self.months)
+        cell = path_id * width + self.month_index[month_name]
+        if cell >= len(self.views):
+            missing = (path_id + 1) * width - len(self.views)
+            self.views.extend([0] * missing)
+            self.seen.extend(bytes(missing))
+        self.views[cell] += views
+        self.seen[cell] = 1
+
+    def add(self, path, month_name, views):
+        self.add_id(self.dictionary.id(path), month_name, views)
+
+    def add_store(self, store, month_name):
+        if store.dictionary is self.dictionary:
+            for path_id, views in store:
+                self.add_id(path_id, month_name, views)
+        else:
+            for path, views in store.items():
+                self.add(path, month_name, views)
+
+    def __len__(self):
+        return len(self.views) // len(self.months) if self.months else 0
+
+    def __cells(self):
+        width = len(self.months)
+        paths = self.dictionary.paths
+        for row in range(len(self)):
+            offset = row * width
+            cells = [
+                (name, self.views[offset + column])
+                for column, name in enumerate(self.months)
+                if self.seen[offset + column]
+            ]
+            if cells:
+                yield self.prefix + paths[row], cells
+
+    def rows(self):
+        for path, cells in self.__cells():
+            record = {'path': path}
+            record.update(cells)
+            yield record
+
+    def iter_long(self):
+        for path, cells in self.__cells():
+            for name, views in cells:
+                yield path, name, views
+
+    def write_csv(self, filename):
+        with open(filename, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=['path'] + self.months)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+    def write(self, stem, fmt='csv'):
+        filename = datasets.filename_for(stem, fmt)
+        if fmt == 'csv':
+            self.write_csv(filename)
+        else:
+            datasets.write_long(self.iter_long(), filename, fmt)
+        return filename
+
+
+def main(argv=None, prog=None, service=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Monthly views for every stream.lib.utk.edu path.')
+    add_connection_arguments(parser, view_id="42472462")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--workers', type=int, help='Number of months to crawl at once on threads (default 4).')
+    mode.add_argument('--async', dest='use_async', action='store_true', help='Crawl every month over asyncio.')
+    parser.add_argument('--concurrency', type=int, help='Requests in flight at once with --async (default 10).')
+    parser.add_argument('--start', help='First month to crawl as YYYY-MM. Defaults to streamer.start in config.yml.')
+    parser.add_argument('--end', help='Last month to crawl as YYYY-MM. Defaults to streamer.end in config.yml.')
+    parser.add_argument('--checkpoints', default='final_months', help='Directory of completed per-month CSVs.')
+    parser.add_argument('--full', action='store_true', help='Crawl every month again, ignoring checkpoints.')
+    parser.add_argument('--output', default='months/final', help='Pivot file name, without extension.')
+    parser.add_argument('--format', choices=datasets.FORMATS, default='csv', help='Output format for the pivot.')
+    args = parser.parse_args(argv)
+    if args.concurrency is not None and not args.use_async:
+        parser.error('--concurrency only applies with --async')
+    metrics = Metrics.for_file(args.metrics)
+    request_scheduler = RequestScheduler()
+    config = load_config(args.config).get('streamer', {})
+    months = MonthBuilder(
+        start=args.start or config.get('start', '2019-07'),
+        end=args.end or config.get('end', '2022-07'),
+    ).months
+    dictionary = PathDictionary()
+    pivot = MonthlyPivot(months, dictionary=dictionary, prefix=STREAM_HOST)
+    checkpoints = MonthCheckpoints(args.checkpoints)
+    missing = []
+    with metrics.stage('checkpoints'):
         for month in months:
-            fieldnames.append(month['name'])
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(final_results)
+            if not args.full and checkpoints.has(month):
+                for path, views in checkpoints.load(month):
+                    pivot.add(path, month['name'], views)
+            else:
+                missing.append(month)
+    print(f'Crawling {len(missing)} of {len(months)} months')
+    cache = None if args.no_cache else ResponseCache(args.cache_file)
 
+    def finished(crawler):
+        checkpoints.save(crawler)
+        print(f'Finished {crawler.current_month["name"]}')
+        pivot.add_store(crawler.current_results, crawler.current_month['name'])
 
+    with metrics.stage('crawl'):
+        if args.use_async:
+            import asyncio
+            connection = AsyncAnalyticsConnection(
+                credentials=args.credentials,
+                view_id=args.view_id,
+                concurrency=args.concurrency or CONCURRENT_REQUESTS_PER_VIEW,
+                cache=cache,
+                service=service,
+                metrics=metrics,
+                scheduler=request_scheduler,
+            )
+            asyncio.run(AsyncCrawlScheduler(connection, dictionary=dictionary).crawl(missing, finished))
+        else:
+            crawl_scheduler = CrawlScheduler(
+                credentials=args.credentials,
+                view_id=args.view_id,
+                workers=args.workers or 4,
+                cache=cache,
+                service=service,
+                metrics=metrics,
+                scheduler=request_scheduler,
+                dictionary=dictionary,
+            )
+            for crawler in crawl_scheduler.crawl(missing):
+                finished(crawler)
+    with metrics.stage('write'):
+        pivot.write(args.output, args.format)
+    print(f'Quota (daily budgets count this run only): {request_scheduler.remaining()}')
+    if args.metrics is not None:
+        metrics.write(args.metrics)
+    metrics.close()
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Throughput benchmarks for the analytics, search_terms and streamer pipelines against FakeReportingService.
+
+    python -m benchmarks.pipelines --rows 10000 1000000 10000000
+
+Each pipeline/row-count case runs in a fresh process so that peak RSS belongs to that case alone.
+"""
+from analytics.analytics import AnalyticsConnection, BULK_CHUNK_SIZE, CollectionIndex
+from analytics.fake import FakeReportingService
+from analytics.search_terms import AnalyticsConnection as SearchConnection, SearchTermAggregator, SearchTermParser
+from analytics.rows import PathDictionary, RowStore
+from analytics.streamer import STREAM_HOST, AnalyticsConnection as StreamConnection, MonthBuilder, MonthlyPivot
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import math
+import multiprocessing
+import resource
+import time
+import yaml
+
+SEARCH_PAGE = "digital.lib.utk.edu/collections/islandora/search"
+
+
+def counted(rows, counter):
+    """Passes rows through, counting them in counter[0]."""
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def analytics_pipeline(rows, page_size, latency):
+    collections = yaml.safe_load(open('config.yml', 'r'))['collections']
+    reports = math.ceil(len(collections) / BULK_CHUNK_SIZE)
+    service = FakeReportingService(rows=math.ceil(rows / reports), page_size=page_size, latency=latency)
+    connection = AnalyticsConnection(credentials=None, view_id="118513499", service=service)
+    all_sources = {}
+    processed = 0
+    for collection, result in CollectionIndex(collections).dispatch(
+            connection.iter_bulk_rows(collections, start_date='365daysago', end_date='today')
+    ):
+        source = result['dimensions'][2]
+        all_sources[source] = all_sources.get(source, 0) + int(result['metrics'][0]['values'][0])
+        processed += 1
+    return processed
+
+
+def search_terms_pipeline(rows, page_size, latency):
+    service = FakeReportingService(rows=rows, page_size=page_size, latency=latency)
+    connection = SearchConnection(credentials=None, view_id="118513499", service=service)
+    parser = SearchTermParser()
+    search_terms = SearchTermAggregator()
+    processed = 0
+    for batch in connection.iter_row_batches(SEARCH_PAGE, start_date='365daysago', end_date='today'):
+        search_terms.add_parsed(batch, parser.parse([row['dimensions'][0] for row in batch]))
+        processed += len(batch)
+    search_terms.top(50)
+    return processed
+
+
+def streamer_pipeline(rows, page_size, latency):
+    months = MonthBuilder(start='2021-01', end='2021-12').months
+    service = FakeReportingService(rows=math.ceil(rows / len(months)), page_size=page_size, latency=latency)
+    connection = StreamConnection(credentials=None, view_id="42472462", service=service)
+    dictionary = PathDictionary()
+    pivot = MonthlyPivot(months, dictionary=dictionary, prefix=STREAM_HOST)
+    processed = [0]
+    for month in months:
+        store = RowStore(dictionary)
+        store.add_rows(counted(connection.iter_rows(start_date=month['start'], end_date=month['end']), processed))
+        pivot.add_store(store.compact(), month['name'])
+    return processed[0]
+
+
+PIPELINES = {
+    'analytics': analytics_pipeline,
+    'search_terms': search_terms_pipeline,
+    'streamer': streamer_pipeline,
+}
+
+
+def run_case(pipeline, rows, page_size, latency):
+    start = time.perf_counter()
+    processed = PIPELINES[pipeline](rows, page_size, latency)
+    wall = time.perf_counter() - start
+    return {
+        'pipeline': pipeline,
+        'rows': processed,
+        'wall_seconds': round(wall, 3),
+        'rows_per_second': round(processed / wall) if wall > 0 else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    parser.add_argument('--pipelines', nargs='+', choices=sorted(PIPELINES), default=sorted(PIPELINES))
+    parser.add_argument('--page-size', type=int, default=10000, help='Rows per fake API page.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of simulated latency per API call.')
+    parser.add_argument('--json', action='store_true', help='Print one JSON object per case instead of a table.')
+    args = parser.parse_args(argv)
+    context = multiprocessing.get_context('spawn')
+    if not args.json:
+        print(f"{'pipeline':<14}{'rows':>12}{'wall s':>10}{'rows/s':>12}{'peak MB':>10}")
+    for rows in args.rows:
+        for pipeline in args.pipelines:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_case, pipeline, rows, args.page_size, args.latency).result()
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{result['pipeline']:<14}{result['rows']:>12}{result['wall_seconds']:>10}"
+                    f"{result['rows_per_second']:>12}{result['peak_rss_mb']:>10}"
+                )
+
+
+if __name__ == "__main__":
+    main()
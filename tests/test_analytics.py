@@ -0,0 +1,192 @@
+from analytics.analytics import (
+    AnalyticsConnection,
+    AnalyticsInterpretter,
+    AsyncAnalyticsConnection,
+    BatchReportFetcher,
+    CollectionIndex,
+    SourceNormalizer,
+)
+from analytics.fake import FakeReportingService
+from collections import Counter
+import asyncio
+import itertools
+import yaml
+
+COLLECTIONS = [f"digital.lib.utk.edu/collections/islandora/object/collections:c{i}" for i in range(12)]
+FIELDS = {
+    'ga:pagePath': 0,
+    'ga:landingPagePath': 1,
+    'ga:fullReferrer': 2,
+    'ga:source': 3,
+    'ga:pageTitle': 4,
+    'ga:yearMonth': 6,
+}
+
+
+def dataset():
+    """
+    Hits as (pagePath, landingPagePath, fullReferrer, source, pageTitle, views, yearMonth), including pages outside
+    config.yml.
+    """
+    pages = COLLECTIONS + ['digital.lib.utk.edu/', COLLECTIONS[0] + '?page=2']
+    hits = []
+    for i, (page, landing, source) in enumerate(itertools.product(pages, pages, ['google', 't.co', '(direct)'])):
+        if i % 4 == 0 or page == landing:
+            hits.append((page, landing, source + '/ref', source, f"Title {i}", i % 7 + 1, f"20220{i % 3 + 1}"))
+    return hits
+
+
+class DatasetConnection(AnalyticsConnection):
+    """Answers report requests from a list of hits, following the landing page filter and paging by pageSize."""
+    def __init__(self, hits, page_size=7):
+        self.view_id = '118513499'
+        self.hits = hits
+        self.page_size = page_size
+        self.requests = []
+
+    def report(self, report_request):
+        expressions = report_request['dimensionFilterClauses'][0]['filters'][0]['expressions']
+        names = [dimension['name'] for dimension in report_request['dimensions']]
+        matching = [hit for hit in self.hits if hit[1] in expressions]
+        start = int(report_request.get('pageToken', 0))
+        report = {
+            'data': {
+                'rows': [
+                    {'dimensions': [hit[FIELDS[name]] for name in names], 'metrics': [{'values': [str(hit[5])]}]}
+                    for hit in matching[start:start + self.page_size]
+                ]
+            }
+        }
+        if start + self.page_size < len(matching):
+            report['nextPageToken'] = str(start + self.page_size)
+        return report
+
+    def execute(self, request):
+        self.requests.append(request)
+        return {'reports': [self.report(report_request) for report_request in request['reportRequests']]}
+
+
+def views(matches):
+    """Views per (collection, pagePath, source) from (collection, row) matches."""
+    totals = Counter()
+    for collection, row in matches:
+        totals[(collection, row['dimensions'][0], row['dimensions'][2])] += int(row['metrics'][0]['values'][0])
+    return totals
+
+
+def test_dispatch_matches_exact_collections_only():
+    index = CollectionIndex(COLLECTIONS[:2])
+    rows = [
+        {'dimensions': [COLLECTIONS[0], 'google', 'google', 'Title', COLLECTIONS[0]]},
+        {'dimensions': [COLLECTIONS[1], 'google', 'google', 'Title', COLLECTIONS[0]]},
+        {'dimensions': [COLLECTIONS[2], 'google', 'google', 'Title', COLLECTIONS[2]]},
+        {'dimensions': [COLLECTIONS[1] + '?page=2', 'google', 'google', 'Title', COLLECTIONS[1] + '?page=2']},
+        {'dimensions': [COLLECTIONS[1], 't.co', 't.co', 'Title', COLLECTIONS[1]]},
+    ]
+    assert [(collection, row['dimensions'][1]) for collection, row in index.dispatch(rows)] == [
+        (COLLECTIONS[0], 'google'),
+        (COLLECTIONS[1], 't.co'),
+    ]
+    assert COLLECTIONS[0] in index
+    assert COLLECTIONS[2] not in index
+
+
+def test_bulk_requests_are_chunked_in_lists():
+    connection = DatasetConnection(dataset())
+    list(connection.iter_bulk_rows(COLLECTIONS, start_date='2022-01-01', end_date='2022-01-31', chunk_size=5))
+    first_pages = [request for request in connection.requests if 'pageToken' not in request['reportRequests'][0]]
+    filters = [request['reportRequests'][0]['dimensionFilterClauses'][0]['filters'][0] for request in first_pages]
+    assert [len(dimension_filter['expressions']) for dimension_filter in filters] == [5, 5, 2]
+    assert all(dimension_filter['operator'] == 'IN_LIST' for dimension_filter in filters)
+    assert first_pages[0]['reportRequests'][0]['dimensions'][-1] == {'name': 'ga:landingPagePath'}
+    assert connection.build_request(COLLECTIONS[0])['dimensionFilterClauses'][0]['filters'][0]['operator'] == 'EXACT'
+
+
+def test_bulk_dispatch_matches_per_collection_reports():
+    connection = DatasetConnection(dataset())
+    per_collection = (
+        (collection, row)
+        for collection in COLLECTIONS
+        for row in connection.iter_rows(collection, start_date='2022-01-01', end_date='2022-01-31')
+        if row['dimensions'][0] == collection
+    )
+    expected = views(per_collection)
+    bulk = CollectionIndex(COLLECTIONS).dispatch(
+        connection.iter_bulk_rows(COLLECTIONS, start_date='2022-01-01', end_date='2022-01-31', chunk_size=5)
+    )
+    assert views(bulk) == expected
+    assert len(expected) > len(COLLECTIONS)
+
+
+def test_batch_fetcher_matches_single_reports():
+    service = FakeReportingService(rows=230, page_size=100)
+    fetched = BatchReportFetcher(credentials=None, view_id='118513499', workers=3, service=service).fetch(
+        COLLECTIONS, start_date='2022-01-01', end_date='2022-01-31'
+    )
+    single = AnalyticsConnection(credentials=None, view_id='118513499', service=service)
+    assert set(fetched) == set(COLLECTIONS)
+    for collection in COLLECTIONS:
+        assert fetched[collection] == list(single.iter_rows(collection, start_date='2022-01-01', end_date='2022-01-31'))
+
+
+def test_async_fetch_matches_batch_fetcher():
+    service = FakeReportingService(rows=230, page_size=100)
+    fetched = BatchReportFetcher(credentials=None, view_id='118513499', workers=3, service=service).fetch(
+        COLLECTIONS, start_date='2022-01-01', end_date='2022-01-31'
+    )
+    connection = AsyncAnalyticsConnection(credentials=None, view_id='118513499', concurrency=4, service=service)
+    assert asyncio.run(connection.fetch(COLLECTIONS, start_date='2022-01-01', end_date='2022-01-31')) == fetched
+
+
+def test_async_connection_builds_the_same_requests():
+    service = FakeReportingService(rows=30, page_size=100)
+    sync = AnalyticsConnection(credentials=None, view_id='118513499', service=service)
+    connection = AsyncAnalyticsConnection(credentials=None, view_id='118513499', service=service)
+    assert connection.build_request(COLLECTIONS[0], token=100) == sync.build_request(COLLECTIONS[0], token=100)
+    assert connection.bulk_requests(COLLECTIONS, chunk_size=5) == sync.bulk_requests(COLLECTIONS, chunk_size=5)
+
+    async def run():
+        async with connection:
+            return await connection.find_pages(COLLECTIONS[0]), await connection.process_pages(COLLECTIONS[0])
+    page, rows = asyncio.run(run())
+    assert page == sync.find_pages(COLLECTIONS[0])
+    assert rows == sync.process_pages(COLLECTIONS[0])
+
+
+def test_normalizer_rule_order():
+    normalizer = SourceNormalizer(
+        domains={'m.facebook.com': 'facebook mobile'},
+        suffixes={'facebook.com': 'facebook', 'google.com': 'google', 'books.google.com': 'google books'},
+        patterns={r'^(bing|duckduckgo)$': 'other search', r'mail': 'email'},
+    )
+    assert normalizer.normalize('m.facebook.com') == 'facebook mobile'
+    assert normalizer.normalize('l.facebook.com') == 'facebook'
+    assert normalizer.normalize('facebook.com') == 'facebook'
+    assert normalizer.normalize('notfacebook.com') == 'notfacebook.com'
+    assert normalizer.normalize('books.google.com') == 'google books'
+    assert normalizer.normalize('scholar.google.com') == 'google'
+    assert normalizer.normalize('bing') == 'other search'
+    assert normalizer.normalize('bingo') == 'bingo'
+    assert normalizer.normalize('mail.google.com') == 'google'
+    assert normalizer.normalize('us13.campaign-mail.com') == 'email'
+    assert normalizer.normalize('(direct)') == '(direct)'
+    assert normalizer.normalize('l.facebook.com') == 'facebook'
+
+
+def test_normalizer_from_config():
+    with open('config.yml') as f:
+        normalizer = SourceNormalizer.from_config(yaml.safe_load(f))
+    assert normalizer.normalize('t.co') == 'twitter'
+    assert normalizer.normalize('lm.facebook.com') == 'facebook'
+    assert normalizer.referral('https://utk.primo.exlibrisgroup.com/discovery/search?q=x') == 'primo'
+    assert normalizer.referral('google') is None
+    defaults = SourceNormalizer.from_config({})
+    assert defaults.normalize('search.google.com') == 'google'
+    assert defaults.referral('utk.primo.exlibrisgroup.com/discovery') == 'primo'
+
+
+def test_interpretter_combines_sources():
+    interpretter = AnalyticsInterpretter({'google': 50, 'search.google.com': 25, 't.co': 20, 'l.facebook.com': 5})
+    assert interpretter.original_data == {'google': 75, 'twitter': 20, 'facebook': 5}
+    assert list(interpretter.original_data) == ['google', 'twitter', 'facebook']
+    assert interpretter.data_as_percentages == {'google': '75.0%', 'twitter': '20.0%', 'facebook': '5.0%'}
@@ -0,0 +1,100 @@
+from analytics import cache as cache_module
+from analytics.cache import ResponseCache
+from types import SimpleNamespace
+import datetime
+import json
+import pytest
+import zlib
+
+OPEN = {'reportRequests': [{'viewId': '1', 'dateRanges': [{'startDate': '30daysAgo', 'endDate': 'today'}]}]}
+
+
+def closed(page):
+    return {
+        'reportRequests': [
+            {'viewId': '1', 'pageToken': str(page), 'dateRanges': [{'startDate': '2020-01-01', 'endDate': '2020-01-31'}]}
+        ]
+    }
+
+
+def response(i):
+    return {'reports': [{'data': {'rows': [{'dimensions': [f'/page/{i}/{j}'], 'metrics': [{'values': [str(j)]}]} for j in range(20)]}}]}
+
+
+def stored_size(value):
+    return len(zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8')))
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only the cache's view of time moves; date.today() reads time.time() too and must stay real.
+    clock = Clock(1000000.0)
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(time=clock))
+    return clock
+
+
+def test_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    cache.put(closed(0), response(0))
+    assert cache.get(closed(0)) == response(0)
+    assert cache.get(closed(1)) is None
+
+
+def test_open_ranges_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    cache.put(OPEN, response(0))
+    clock.now += 59
+    assert cache.get(OPEN) == response(0)
+    clock.now += 2
+    assert cache.get(OPEN) is None
+
+
+def test_closed_ranges_never_expire(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    cache.put(closed(0), response(0))
+    clock.now += 365 * 24 * 60 * 60
+    assert cache.get(closed(0)) == response(0)
+
+
+def test_open_entries_are_dropped_once_their_range_closes(tmp_path, clock, monkeypatch):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    state = SimpleNamespace(closed=False)
+    monkeypatch.setattr(ResponseCache, 'is_closed', staticmethod(lambda request, today=None: state.closed))
+    cache.put(closed(0), response(0))
+    assert cache.get(closed(0)) == response(0)
+    state.closed = True
+    assert cache.get(closed(0)) is None
+    cache.put(closed(0), response(1))
+    clock.now += 365 * 24 * 60 * 60
+    assert cache.get(closed(0)) == response(1)
+
+
+def test_is_closed_waits_for_processing_days():
+    request = {'reportRequests': [{'dateRanges': [{'startDate': '2022-01-01', 'endDate': '2022-01-31'}]}]}
+    after = datetime.date(2022, 1, 31) + datetime.timedelta(days=cache_module.PROCESSING_DAYS)
+    assert not ResponseCache.is_closed(request, today=after)
+    assert ResponseCache.is_closed(request, today=after + datetime.timedelta(days=1))
+    assert not ResponseCache.is_closed(OPEN)
+
+
+def test_eviction_drops_least_recently_read(tmp_path, clock):
+    sizes = [stored_size(response(i)) for i in range(3)]
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=sum(sizes) - 1)
+    cache.put(closed(0), response(0))
+    clock.now += 1
+    cache.put(closed(1), response(1))
+    clock.now += 1
+    assert cache.get(closed(0)) == response(0)
+    clock.now += 1
+    cache.put(closed(2), response(2))
+    assert cache.get(closed(1)) is None
+    assert cache.get(closed(0)) == response(0)
+    assert cache.get(closed(2)) == response(2)
@@ -0,0 +1,93 @@
+from analytics import analytics, cli, search_terms, streamer
+from analytics.fake import FakeReportingService
+import csv
+import json
+import pytest
+import subprocess
+import sys
+
+
+def test_imports_stay_lazy():
+    code = (
+        "import sys, analytics.cli, analytics.analytics, analytics.search_terms, analytics.streamer; "
+        "print(sorted({m.split('.')[0] for m in sys.modules} & "
+        "{'googleapiclient', 'oauth2client', 'httplib2', 'yaml', 'asyncio', 'aiohttp'}))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_commands_dispatch_to_their_module(capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(['streamer', '--help'])
+    assert exit.value.code == 0
+    assert capsys.readouterr().out.startswith('usage: collection-query streamer')
+    with pytest.raises(SystemExit):
+        cli.main(['nonsense'])
+
+
+@pytest.fixture
+def config(tmp_path):
+    filename = tmp_path / 'config.yml'
+    filename.write_text(
+        'streamer:\n  start: 2022-01\n  end: 2022-02\n'
+        'collections:\n  - rfta.lib.utk.edu/\n  - digital.lib.utk.edu/collections/islandora/object/collections:civilwar\n'
+    )
+    return str(filename)
+
+
+def test_analytics_main(config, tmp_path, capsys):
+    analytics.main(
+        [
+            '--config', config, '--no-cache', '--start-date', '2022-01-01', '--end-date', '2022-01-31',
+            '--output', str(tmp_path / 'sources.csv'),
+        ],
+        service=FakeReportingService(rows=300),
+    )
+    sources = capsys.readouterr().out.splitlines()[0]
+    assert "'google'" in sources and "'twitter'" in sources
+
+
+@pytest.mark.parametrize(
+    'options',
+    [
+        ['--async', '--workers', '2'],
+        ['--bulk', '--async'],
+        ['--bulk', '--workers', '0'],
+        ['--async', '--shard-days', '7'],
+        ['--concurrency', '5'],
+    ],
+)
+def test_analytics_rejects_conflicting_fetch_flags(config, tmp_path, options):
+    with pytest.raises(SystemExit):
+        analytics.main(['--config', config, '--output', str(tmp_path / 'sources.csv'), *options])
+
+
+def test_search_terms_main(config, tmp_path):
+    service = FakeReportingService(rows=400, distinct_paths=60)
+    search_terms.main(
+        ['--config', config, '--no-cache', '--output-dir', str(tmp_path), '--top', '10'],
+        service=service,
+    )
+    with open(tmp_path / 'basic.csv', newline='') as f:
+        totals = [int(row['total']) for row in csv.DictReader(f)]
+    assert len(totals) == 10 and totals == sorted(totals, reverse=True)
+    assert [item[1]['values'] for item in json.load(open(tmp_path / 'full.json'))] == totals
+
+
+def test_streamer_main(config, tmp_path):
+    service = FakeReportingService(rows=200, distinct_paths=50)
+    argv = ['--config', config, '--no-cache', '--checkpoints', str(tmp_path / 'final_months'), '--output', str(tmp_path / 'final')]
+    streamer.main(argv, service=service)
+    with open(tmp_path / 'final.csv', newline='') as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == ['path', 'Jan 2022', 'Feb 2022']
+        assert len(list(reader)) == 50
+    with open(tmp_path / 'final.csv') as f:
+        threaded = f.read()
+    calls = service.calls
+    streamer.main(argv, service=service)
+    assert service.calls == calls
+    streamer.main(argv + ['--async', '--output', str(tmp_path / 'async'), '--checkpoints', str(tmp_path / 'again')], service=service)
+    with open(tmp_path / 'async.csv') as f:
+        assert f.read() == threaded
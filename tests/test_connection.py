@@ -0,0 +1,72 @@
+from analytics.connection import ReportingConnection, thread_local_connection
+from concurrent.futures import ThreadPoolExecutor
+
+REQUEST = {
+    'viewId': '118513499',
+    'dateRanges': [{'startDate': '2022-01-01', 'endDate': '2022-01-31'}],
+    'dimensions': [{'name': 'ga:pagePath'}],
+    'metrics': [{'expression': 'ga:pageviews'}],
+    'dimensionFilterClauses': [
+        {'filters': [{'dimensionName': 'ga:pagePath', 'operator': 'BEGINS_WITH', 'expressions': ['/collections']}]}
+    ],
+}
+
+
+class PagedConnection(ReportingConnection):
+    """Answers execute() from a fixed list of pages and records every request body sent."""
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def execute(self, request):
+        self.requests.append(request)
+        report_request = request['reportRequests'][0]
+        page = int(report_request.get('pageToken', 0))
+        report = {'data': {'rows': self.pages[page]}} if self.pages[page] else {'data': {}}
+        if page + 1 < len(self.pages):
+            report['nextPageToken'] = str(page + 1)
+        return {'reports': [report]}
+
+
+def rows(*paths):
+    return [{'dimensions': [path], 'metrics': [{'values': ['1']}]} for path in paths]
+
+
+def test_pages_follow_next_page_token():
+    connection = PagedConnection([rows('/a', '/b'), rows('/c'), rows('/d')])
+    pages = list(connection.iter_report_pages(REQUEST))
+    assert len(pages) == 3
+    assert [request['reportRequests'][0].get('pageToken') for request in connection.requests] == [None, '1', '2']
+
+
+def test_pages_keep_filter_and_date_range():
+    connection = PagedConnection([rows('/a'), rows('/b'), rows('/c')])
+    list(connection.iter_report_pages(REQUEST))
+    for request in connection.requests:
+        sent = dict(request['reportRequests'][0])
+        sent.pop('pageToken', None)
+        assert sent == REQUEST
+    assert 'pageToken' not in REQUEST
+
+
+def test_rows_are_streamed_in_order():
+    connection = PagedConnection([rows('/a', '/b'), [], rows('/c')])
+    rows_seen = connection.iter_report_rows(REQUEST)
+    assert next(rows_seen)['dimensions'] == ['/a']
+    assert len(connection.requests) == 1
+    assert [row['dimensions'][0] for row in rows_seen] == ['/b', '/c']
+    assert len(connection.requests) == 3
+
+
+def test_thread_local_connection_is_one_per_thread():
+    made = []
+
+    def factory():
+        made.append(object())
+        return made[-1]
+    connection = thread_local_connection(factory)
+    assert connection() is connection()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        others = set(map(id, executor.map(lambda _: connection(), range(30))))
+    assert id(connection()) not in others
+    assert len(made) == 1 + len(others) and len(others) <= 3
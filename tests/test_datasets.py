@@ -0,0 +1,28 @@
+from analytics import datasets
+import pytest
+
+pytest.importorskip('pyarrow')
+
+RECORDS = [(f"/media/{i % 40}", f"2022-{i % 12 + 1:02d}", i) for i in range(300)]
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_long_round_trip(tmp_path, monkeypatch, fmt):
+    monkeypatch.setattr(datasets, 'BATCH_ROWS', 64)
+    filename = datasets.filename_for(str(tmp_path / 'final'), fmt)
+    datasets.write_long(iter(RECORDS), filename, fmt)
+    table = datasets.load(filename)
+    assert table.schema == datasets.long_schema()
+    assert list(zip(*(table.column(name).to_pylist() for name in ('path', 'month', 'views')))) == RECORDS
+
+
+def test_columns_round_trip(tmp_path):
+    columns = {'search_term': ['knoxville', 'music'], 'total': [4, 2]}
+    filename = datasets.filename_for(str(tmp_path / 'basic'), 'parquet')
+    datasets.write_columns(columns, filename)
+    assert datasets.load(filename).to_pydict() == columns
+
+
+def test_filename_for():
+    assert datasets.filename_for('months/final', 'csv') == 'months/final.csv'
+    assert datasets.filename_for('months/final', 'arrow') == 'months/final.arrow'
@@ -0,0 +1,47 @@
+from analytics.connection import ReportingConnection
+from analytics.fake import FakeReportingService
+from benchmarks import pipelines
+import pytest
+
+REQUEST = {
+    'viewId': '42472462',
+    'dateRanges': [{'startDate': '2022-01-01', 'endDate': '2022-01-31'}],
+    'dimensions': [{'name': 'ga:pagePath'}, {'name': 'ga:source'}],
+    'metrics': [{'expression': 'ga:pageviews'}],
+    'pageSize': 100,
+}
+
+
+def connection(**kwargs):
+    return ReportingConnection(credentials=None, view_id='42472462', service=FakeReportingService(**kwargs))
+
+
+def test_pages_follow_page_size():
+    fake = connection(rows=250)
+    rows = list(fake.iter_report_rows(REQUEST))
+    assert len(rows) == 250
+    assert fake.service.calls == 3
+    assert all(len(row['dimensions']) == 2 for row in rows)
+
+
+def test_rows_follow_filters():
+    request = dict(
+        REQUEST,
+        dimensionFilterClauses=[
+            {'filters': [{'dimensionName': 'ga:landingPagePath', 'operator': 'EXACT', 'expressions': ['rfta.lib.utk.edu/']}]}
+        ],
+    )
+    assert {row['dimensions'][0] for row in connection(rows=50).iter_report_rows(request)} == {'rfta.lib.utk.edu/'}
+
+
+def test_rows_are_deterministic():
+    assert list(connection(rows=120, distinct_paths=30).iter_report_rows(REQUEST)) == list(
+        connection(rows=120, distinct_paths=30).iter_report_rows(REQUEST)
+    )
+
+
+@pytest.mark.parametrize('pipeline, rows', [('search_terms', 2400), ('streamer', 120000)])
+def test_benchmark_case_counts_rows(pipeline, rows):
+    result = pipelines.run_case(pipeline, rows, 10000, 0.0)
+    assert result['pipeline'] == pipeline
+    assert result['rows'] == rows
@@ -0,0 +1,43 @@
+from analytics import merge, streamer
+from analytics.fake import FakeReportingService
+from analytics.merge import read_month, sort_month, write_month
+from analytics.streamer import STREAM_HOST
+from collections import Counter
+import csv
+import random
+
+
+def read_pivot(filename):
+    with open(filename, newline='') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, {row['path']: row for row in reader}
+
+
+def test_sort_month_spills_runs(tmp_path):
+    generator = random.Random(5)
+    pairs = [(f"/media/{generator.randint(0, 80)}", generator.randint(1, 9)) for _ in range(500)]
+    write_month(pairs, str(tmp_path / 'month.csv'))
+    totals = Counter()
+    for path, views in pairs:
+        totals[path] += views
+    for chunk_rows in (1000, 60):
+        target = str(tmp_path / f"sorted-{chunk_rows}.csv")
+        sort_month(str(tmp_path / 'month.csv'), target, chunk_rows=chunk_rows)
+        assert list(read_month(target)) == sorted(totals.items())
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['month.csv', 'sorted-1000.csv', 'sorted-60.csv']
+
+
+def test_merge_matches_pivot(tmp_path):
+    service = FakeReportingService(rows_per_day=10, page_size=70, distinct_paths=250)
+    config = tmp_path / 'config.yml'
+    config.write_text('streamer:\n  start: 2022-01\n  end: 2022-04\n')
+    common = ['--config', str(config), '--checkpoints', str(tmp_path / 'final_months')]
+    streamer.main(common + ['--no-cache', '--workers', '2', '--output', str(tmp_path / 'pivot')], service=service)
+    calls = service.calls
+    merge.main(common + ['--workers', '1', '--chunk-rows', '50', '--output', str(tmp_path / 'merged')])
+    columns, pivot = read_pivot(str(tmp_path / 'pivot.csv'))
+    assert columns == ['path', 'Jan 2022', 'Feb 2022', 'Mar 2022', 'Apr 2022']
+    assert read_pivot(str(tmp_path / 'merged.csv')) == (columns, pivot)
+    assert len(pivot) == 250
+    assert all(path.startswith(STREAM_HOST) for path in pivot)
+    assert service.calls == calls
@@ -0,0 +1,99 @@
+from analytics.cache import ResponseCache
+from analytics.connection import ReportingConnection
+from analytics.fake import FakeReportingService
+from analytics.metrics import LATENCY_BUCKETS, Metrics
+from types import SimpleNamespace
+import json
+
+REQUEST = {
+    'viewId': '42472462',
+    'dateRanges': [{'startDate': '2022-01-01', 'endDate': '2022-01-31'}],
+    'dimensions': [{'name': 'ga:pagePath'}],
+    'metrics': [{'expression': 'ga:pageviews'}],
+    'pageSize': 100,
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.resp = SimpleNamespace(status=status)
+
+
+def crawl(metrics, cache=None):
+    connection = ReportingConnection(
+        credentials=None, view_id='42472462', cache=cache, service=FakeReportingService(rows=250), metrics=metrics
+    )
+    return list(connection.iter_report_rows(REQUEST))
+
+
+def test_requests_pages_and_rows(tmp_path):
+    metrics = Metrics()
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    crawl(metrics, cache)
+    crawl(metrics, cache)
+    summary = metrics.summary()
+    assert summary['requests'] == 6
+    assert summary['cache_hits'] == 3
+    assert summary['pages'] == 6
+    assert summary['rows'] == 500
+    assert summary['rows_per_page'] == round(500 / 6, 1)
+    assert summary['bytes'] > 0
+
+
+def test_errors_and_quota_errors():
+    metrics = Metrics()
+    for error in [
+        HttpError(429),
+        HttpError(403, 'userRateLimitExceeded'),
+        HttpError(403, 'forbidden'),
+        HttpError(500),
+        ConnectionError('reset'),
+    ]:
+        metrics.record_error(error)
+    summary = metrics.summary()
+    assert summary['errors'] == {'429': 1, '403': 2, '500': 1, 'ConnectionError': 1}
+    assert summary['quota_errors'] == 2
+
+
+def test_prometheus_export(tmp_path):
+    metrics = Metrics()
+    crawl(metrics)
+    with metrics.stage('crawl'):
+        pass
+    metrics.record_error(HttpError(503))
+    metrics.write(str(tmp_path / 'run.prom'))
+    samples = {}
+    for line in (tmp_path / 'run.prom').read_text().splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    assert samples['collection_query_requests_total'] == 3
+    assert samples['collection_query_rows_total'] == 250
+    assert samples['collection_query_request_latency_seconds_count'] == 3
+    assert samples['collection_query_request_latency_seconds_bucket{le="+Inf"}'] == 3
+    buckets = [samples[f'collection_query_request_latency_seconds_bucket{{le="{bucket}"}}'] for bucket in LATENCY_BUCKETS]
+    assert buckets == sorted(buckets) and buckets[-1] <= 3
+    assert samples['collection_query_errors_total{kind="503"}'] == 1
+    assert 'collection_query_stage_seconds{stage="crawl"}' in samples
+
+
+def test_json_lines_export(tmp_path):
+    filename = str(tmp_path / 'run.jsonl')
+    metrics = Metrics.for_file(filename)
+    crawl(metrics)
+    metrics.record_error(HttpError(429))
+    metrics.write(filename)
+    metrics.close()
+    events = [json.loads(line) for line in open(filename)]
+    assert [event['event'] for event in events] == ['request'] * 3 + ['error', 'summary']
+    assert [event['rows_per_page'] for event in events[:3]] == [[100], [100], [50]]
+    assert events[-1]['requests'] == 3
+    assert events[-1]['quota_errors'] == 1
+
+
+def test_without_a_file_bytes_are_not_measured():
+    metrics = Metrics.for_file(None)
+    crawl(metrics)
+    assert metrics.summary()['bytes'] == 0
+    assert metrics.summary()['rows'] == 250
@@ -0,0 +1,166 @@
+from analytics import analytics, rollup, streamer
+from analytics.dashboard import CubeFile
+from analytics.fake import FakeReportingService
+from analytics.rollup import ALL, STREAM_COLLECTION, RollupCube, complete_months, month_key, read_sources
+from collections import Counter
+import csv
+import datetime
+import itertools
+import os
+import pytest
+import random
+
+COLLECTIONS = [
+    'digital.lib.utk.edu/collections/islandora/object/collections:volvoices',
+    'digital.lib.utk.edu/collections/islandora/object/collections:civilwar',
+]
+
+
+def brute_force(cells, collection=ALL, source=ALL, month=ALL):
+    return sum(
+        views for (c, s, m), views in cells.items()
+        if collection in (ALL, c) and source in (ALL, s) and month in (ALL, m)
+    )
+
+
+def test_month_key():
+    assert month_key('202301') == month_key('2023-01') == month_key('Jan 2023') == '2023-01'
+
+
+def test_update_sets_cells_and_rollups(tmp_path):
+    generator = random.Random(3)
+    cube = RollupCube()
+    cells = {}
+    for _ in range(5):
+        records = [
+            (f"c{generator.randint(0, 3)}", f"s{generator.randint(0, 4)}", f"2022-{generator.randint(1, 6):02d}", generator.randint(0, 100))
+            for _ in range(40)
+        ]
+        batch = Counter()
+        for collection, source, month, views in records:
+            batch[(collection, source, month)] += views
+        cells.update(batch)
+        assert cube.update(records) == len(batch)
+    assert len(cube) == len(cells)
+    for collection, source, month in itertools.product(
+            cube.members('collection') + [ALL], cube.members('source') + [ALL], cube.members('month') + [ALL]
+    ):
+        assert cube.get(collection, source, month) == brute_force(cells, collection, source, month)
+    cube.save(str(tmp_path / 'cube.json'))
+    loaded = RollupCube.load(str(tmp_path / 'cube.json'))
+    assert loaded.cells == cube.cells
+    assert loaded.get() == cube.get()
+
+
+def test_update_again_replaces_instead_of_adding():
+    cube = RollupCube()
+    cube.update([('c', 's', '202201', 10), ('c', 's', '202202', 5)])
+    cube.update([('c', 's', '2022-01', 4)])
+    assert cube.get('c', 's', '2022-01') == 4
+    assert cube.get(month='Jan 2022') == 4
+    assert cube.get() == 9
+    assert cube.series() == [('2022-01', 4), ('2022-02', 5)]
+    assert cube.breakdown('month') == [('2022-02', 5), ('2022-01', 4)]
+
+
+def test_complete_months():
+    today = datetime.date(2023, 3, 10)
+    assert complete_months(datetime.date(2022, 3, 10), today, today=today) == {
+        f"{year}-{month:02d}" for year, month in [(2022, m) for m in range(4, 13)] + [(2023, 1), (2023, 2)]
+    }
+    assert complete_months(datetime.date(2023, 1, 1), datetime.date(2023, 2, 28), today=datetime.date(2023, 3, 2)) == {
+        '2023-01'
+    }
+    assert complete_months(datetime.date(2023, 1, 1), datetime.date(2023, 2, 28), today=datetime.date(2023, 3, 3)) == {
+        '2023-01', '2023-02'
+    }
+
+
+@pytest.fixture
+def run_analytics(tmp_path):
+    service = FakeReportingService(rows=600)
+    config = tmp_path / 'config.yml'
+    config.write_text('collections:\n' + ''.join(f'  - {collection}\n' for collection in COLLECTIONS))
+
+    def run(start_date, end_date, *options):
+        output = tmp_path / f"sources-{start_date}-{end_date}.csv"
+        analytics.main(
+            [
+                '--config', str(config), '--no-cache', '--start-date', start_date, '--end-date', end_date,
+                '--output', str(output), *options,
+            ],
+            service=service,
+        )
+        return list(read_sources(str(output)))
+    return run
+
+
+def test_sources_by_collection_and_month(run_analytics):
+    records = run_analytics('2022-01-01', '2022-03-31')
+    assert {month for _, _, month, _ in records} == {'2022-01', '2022-02', '2022-03'}
+    assert {collection for collection, _, _, _ in records} == set(COLLECTIONS)
+    assert len(records) == len({record[:3] for record in records})
+
+
+def test_sources_leave_out_partial_months(run_analytics):
+    records = run_analytics('2022-01-15', '2022-03-31')
+    assert {month for _, _, month, _ in records} == {'2022-02', '2022-03'}
+    assert {collection for collection, _, _, _ in records} == set(COLLECTIONS)
+
+
+def test_partial_months_do_not_replace_complete_ones(run_analytics):
+    cube = RollupCube()
+    cube.update(run_analytics('2022-01-01', '2022-03-31'))
+    february = cube.get(month='2022-02')
+    assert february > 0
+    cube.update(run_analytics('2022-02-15', '2022-04-30'))
+    assert cube.get(month='2022-02') == february
+    assert cube.get(month='2022-04') > 0
+
+
+def test_workers_write_the_same_sources(run_analytics):
+    expected = run_analytics('2022-01-01', '2022-03-31')
+    assert run_analytics('2022-01-01', '2022-03-31', '--workers', '2') == expected
+
+
+def test_rollup_merges_sources_and_streams(run_analytics, tmp_path):
+    sources = run_analytics('2022-01-01', '2022-03-31')
+    config = tmp_path / 'streamer.yml'
+    config.write_text('streamer:\n  start: 2022-01\n  end: 2022-03\n')
+    streamer.main(
+        [
+            '--config', str(config), '--no-cache', '--checkpoints', str(tmp_path / 'months'),
+            '--output', str(tmp_path / 'final'),
+        ],
+        service=FakeReportingService(rows=100, distinct_paths=30),
+    )
+    cube_file = str(tmp_path / 'rollup.json')
+    options = [
+        '--sources', str(tmp_path / 'sources-2022-01-01-2022-03-31.csv'),
+        '--streams', str(tmp_path / 'final.csv'),
+        '--cube', cube_file,
+    ]
+    rollup.main(options)
+    with open(tmp_path / 'final.csv', newline='') as f:
+        streams = sum(int(views) for row in csv.reader(itertools.islice(f, 1, None)) for views in row[1:] if views)
+    cube = RollupCube.load(cube_file)
+    assert streams > 0
+    assert cube.get(collection=STREAM_COLLECTION) == streams
+    assert cube.get() == sum(views for _, _, _, views in sources) + streams
+    rollup.main(options)
+    assert RollupCube.load(cube_file).cells == cube.cells
+
+
+def test_cube_file_reloads_when_rewritten(tmp_path):
+    filename = str(tmp_path / 'rollup.json')
+    cube_file = CubeFile(filename)
+    assert len(cube_file.get()) == 0
+    cube = RollupCube()
+    cube.update([('c', 's', '2022-01', 3)])
+    cube.save(filename)
+    assert cube_file.get().get() == 3
+    assert cube_file.get() is cube_file.get()
+    cube.update([('c', 's', '2022-02', 4)])
+    cube.save(filename)
+    os.utime(filename, (os.stat(filename).st_atime, os.stat(filename).st_mtime + 5))
+    assert cube_file.get().get() == 7
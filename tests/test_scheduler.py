@@ -0,0 +1,175 @@
+from analytics.aio import ReportingHttpError
+from analytics.connection import ReportingConnection
+from analytics.fake import FakeReportingService
+from analytics.metrics import is_quota_error
+from analytics.scheduler import QuotaExhausted, RequestScheduler, TokenBucket
+from types import SimpleNamespace
+import asyncio
+import pytest
+
+
+class HttpError(Exception):
+    """Shaped like googleapiclient's HttpError: the status is on error.resp."""
+    def __init__(self, status, content):
+        super().__init__(content)
+        self.resp = SimpleNamespace(status=status)
+
+
+def scheduler(**kwargs):
+    sleeps = []
+    return RequestScheduler(sleep=sleeps.append, **kwargs), sleeps
+
+
+def failing(errors, result='ok'):
+    errors = list(errors)
+
+    def send():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return send
+
+
+@pytest.mark.parametrize(
+    'error, retryable',
+    [
+        (ConnectionError('reset'), True),
+        (TimeoutError('slow'), True),
+        (HttpError(429, 'Too many requests'), True),
+        (HttpError(500, 'Backend error'), True),
+        (HttpError(503, 'Unavailable'), True),
+        (HttpError(403, 'userRateLimitExceeded'), True),
+        (HttpError(403, 'quotaExceeded'), True),
+        (HttpError(403, 'The caller does not have permission'), False),
+        (HttpError(400, 'Invalid dimension'), False),
+        (ReportingHttpError(429, 'Too many requests'), True),
+        (ReportingHttpError(403, 'rateLimitExceeded'), True),
+        (ReportingHttpError(401, 'Invalid credentials'), False),
+        (ValueError('bad'), False),
+    ],
+)
+def test_is_retryable(error, retryable):
+    assert RequestScheduler.is_retryable(error) is retryable
+
+
+def test_quota_errors_are_retryable():
+    quota = [HttpError(429, ''), HttpError(403, 'quotaExceeded'), ReportingHttpError(403, 'RESOURCE_EXHAUSTED')]
+    assert all(is_quota_error(error) and RequestScheduler.is_retryable(error) for error in quota)
+    assert not is_quota_error(HttpError(503, 'Backend error'))
+    assert not is_quota_error(HttpError(403, 'The caller does not have permission'))
+
+
+def test_retries_retryable_errors_with_backoff():
+    requests, sleeps = scheduler(base_delay=1.0, max_delay=4.0)
+    errors = []
+    send = failing([HttpError(503, ''), ConnectionError('reset')])
+    assert requests.call('1', send, on_error=errors.append) == 'ok'
+    assert requests.retries == 2
+    assert len(errors) == 2
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0
+
+
+def test_does_not_retry_other_errors():
+    requests, sleeps = scheduler()
+    with pytest.raises(HttpError):
+        requests.call('1', failing([HttpError(400, 'Invalid')]))
+    assert requests.retries == 0
+    assert sleeps == []
+
+
+def test_gives_up_after_max_retries():
+    requests, sleeps = scheduler(max_retries=2)
+    with pytest.raises(HttpError):
+        requests.call('1', failing([HttpError(500, '')] * 5))
+    assert requests.retries == 2
+    assert requests.used == 3
+
+
+def test_daily_budget():
+    requests, _ = scheduler(daily_limit=2)
+    requests.call('1', failing([]))
+    requests.call('1', failing([]))
+    with pytest.raises(QuotaExhausted):
+        requests.call('1', failing([]))
+    assert requests.remaining()['daily_requests_left_this_run'] == 0
+    assert requests.remaining()['requests_this_run'] == 2
+
+
+def test_daily_budget_per_view():
+    requests, _ = scheduler(daily_limit=5, daily_limit_per_view=2)
+    requests.call('1', failing([]))
+    requests.call('1', failing([]))
+    with pytest.raises(QuotaExhausted):
+        requests.call('1', failing([]))
+    assert requests.call('2', failing([])) == 'ok'
+    remaining = requests.remaining()
+    assert remaining['view_requests_left_this_run'] == {'1': 0, '2': 1}
+    assert remaining['daily_requests_left_this_run'] == 2
+
+
+def test_retries_count_against_the_view_budget():
+    requests, _ = scheduler(base_delay=0.0, daily_limit_per_view=2)
+    with pytest.raises(QuotaExhausted):
+        requests.call('1', failing([HttpError(503, '')] * 2))
+    assert requests.used_by_view == {'1': 2}
+
+
+def test_call_async_retries():
+    requests, _ = scheduler(base_delay=0.0)
+
+    async def run():
+        errors = [ReportingHttpError(429, '')]
+
+        async def send():
+            if errors:
+                raise errors.pop()
+            return 'ok'
+        return await requests.call_async('1', send)
+    assert asyncio.run(run()) == 'ok'
+    assert requests.retries == 1
+
+
+def test_token_bucket_waits_for_refill():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    bucket = TokenBucket(rate=2.0, capacity=1, clock=lambda: now[0], sleep=sleep)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert sleeps == [pytest.approx(0.5)]
+
+
+class FlakyService(FakeReportingService):
+    """Fails every other call with a 503."""
+    attempts = 0
+
+    def batchGet(self, body):
+        execute = super().batchGet(body).execute
+
+        def flaky():
+            self.attempts += 1
+            if self.attempts % 2 == 1:
+                raise HttpError(503, 'Backend error')
+            return execute()
+        return SimpleNamespace(execute=flaky)
+
+
+def test_connection_retries_through_the_scheduler():
+    requests, _ = scheduler(base_delay=0.0)
+    connection = ReportingConnection(
+        credentials=None, view_id='42472462', service=FlakyService(rows=250), scheduler=requests
+    )
+    request = {
+        'viewId': '42472462',
+        'dateRanges': [{'startDate': '2022-01-01', 'endDate': '2022-01-31'}],
+        'dimensions': [{'name': 'ga:pagePath'}],
+        'metrics': [{'expression': 'ga:pageviews'}],
+        'pageSize': 100,
+    }
+    assert len(list(connection.iter_report_rows(request))) == 250
+    assert requests.retries == 3
+    assert requests.used == 6
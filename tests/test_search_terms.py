@@ -0,0 +1,200 @@
+from analytics.search_terms import (
+    SEARCH_PATH,
+    SearchTerm,
+    SearchTermAggregator,
+    SearchTermIndex,
+    SearchTermParser,
+    SpilledSearches,
+    TopK,
+    normalize_term,
+)
+from collections import Counter
+import csv
+import json
+import random
+
+URLS = [
+    SEARCH_PATH + 'knoxville?type=dismax',
+    SEARCH_PATH + 'civil%20war?type=dismax&cp=collections:civilwar',
+    SEARCH_PATH + 'utk_mods_subject_topic_ms:Music?type=dismax',
+    SEARCH_PATH + 'bridge?type=dismax&cp=collections:volvoices&page=2',
+    SEARCH_PATH + 'tennessee&f[0]=x?type=dismax',
+    SEARCH_PATH + 'dolly?type=dismax&islandora_solr_search_navigation=1&f[0]=mods_genre:"photographs"&f[1]=',
+    SEARCH_PATH + '?type=dismax&islandora_solr_search_navigation=0&f[0]=utk_mods_subject:"Knoxville"&f[1]=a=b',
+    SEARCH_PATH + '%2A?type=dismax&cp=',
+    SEARCH_PATH + 'a/b?type=dismax',
+    'digital.lib.utk.edu/collections/islandora/object/collections:volvoices',
+] + [f"{SEARCH_PATH}term{i}?type=dismax&cp=collections:c{i % 20}" for i in range(200)]
+
+
+def test_parser_matches_search_term():
+    parser = SearchTermParser()
+    for url in URLS:
+        expected = SearchTerm(url).results
+        assert parser.parse_one(url) == (
+            expected['search_term'], expected['type'], expected['collection'], expected['facets']
+        ), url
+    columns = parser.parse(URLS)
+    assert columns['full_string'] == URLS
+    assert columns['search_term'] == [SearchTerm(url).search_term for url in URLS]
+    assert columns['type'] == [SearchTerm(url).results['type'] for url in URLS]
+    assert columns['collection'] == [SearchTerm(url).results['collection'] for url in URLS]
+    assert columns['facets'] == [SearchTerm(url).results['facets'] for url in URLS]
+
+
+def random_paths(n, seed=3):
+    generator = random.Random(seed)
+    pieces = [
+        'knox', 'utk_mods_x', '%20', '?type=dismax', '&cp=collections:c1', '&cp=', '&f[0]=a:"b"', '&f[1]=',
+        '&islandora_solr_search_navigation=1', '/', '=', '&', '?', 'page=2',
+    ]
+    prefixes = [SEARCH_PATH, 'digital.lib.utk.edu/collections/', 'a/b/c/d/', '']
+    return [
+        generator.choice(prefixes) + ''.join(generator.choice(pieces) for _ in range(generator.randint(0, 6)))
+        for _ in range(n)
+    ]
+
+
+def test_parser_matches_search_term_on_random_paths():
+    parser = SearchTermParser()
+    paths = []
+    for path in random_paths(3000):
+        try:
+            expected = SearchTerm(path).results
+        except IndexError:
+            continue
+        paths.append(path)
+        assert parser.parse_one(path) == (
+            expected['search_term'], expected['type'], expected['collection'], expected['facets']
+        ), path
+    assert len(paths) > 1000
+    assert parser.parse(paths)['facets'] == [SearchTerm(path).results['facets'] for path in paths]
+
+
+def test_parser_without_search_term():
+    parser = SearchTermParser()
+    assert parser.parse_one('digital.lib.utk.edu/collections') == (None, None, None, [])
+    assert parser.parse(['digital.lib.utk.edu/collections'])['search_term'] == [None]
+
+
+def rows(urls):
+    return [{'dimensions': [url], 'metrics': [{'values': [str(i % 9 + 1)]}]} for i, url in enumerate(urls)]
+
+
+def aggregator(keep_searches=True):
+    terms = SearchTermAggregator(keep_searches=keep_searches)
+    terms.add_parsed(rows(URLS), SearchTermParser().parse(URLS))
+    terms.add('knoxville', 3, collection='collections:volvoices', facets=['"photographs"'], full_string=URLS[0])
+    return terms
+
+
+def test_aggregator_totals_and_sets():
+    terms = aggregator()
+    assert terms.values['knoxville'] == 4
+    assert 'utk_mods_subject_topic_ms:Music' not in terms.values
+    assert '' not in terms.values
+    record = dict(terms.items())['knoxville']
+    assert record == {
+        'values': 4,
+        'collections': ['collections:volvoices'],
+        'facets': ['"photographs"'],
+        'searches': [URLS[0]],
+    }
+    assert dict(aggregator(keep_searches=False).items())['knoxville']['searches'] == []
+
+
+def test_spilled_searches_keep_first_seen_order():
+    searches = SpilledSearches(batch_size=3)
+    for term, search in [('a', 'x'), ('b', 'y'), ('a', 'z'), ('a', 'x'), ('a', 'w'), ('b', 'y')]:
+        searches.add(term, search)
+    assert searches.get('a') == ['x', 'z', 'w']
+    searches.add('b', 'v')
+    assert searches.get('b') == ['y', 'v']
+    assert searches.get('c') == []
+    searches.close()
+
+
+def test_aggregator_normalizes_terms():
+    terms = aggregator()
+    terms.add('Knoxville', 2)
+    terms.add('knoxville%20', 1)
+    assert terms.values['knoxville'] == 7
+    assert 'Knoxville' not in terms.values
+    assert terms.index.counts['knoxville'] == 7
+
+
+def test_top_ranks_by_views():
+    terms = aggregator()
+    ranked = sorted(terms.values.values(), reverse=True)
+    assert [views for _, views in terms.top()] == ranked
+    assert [views for _, views in terms.top(5)] == ranked[:5]
+
+
+def test_write_csv(tmp_path):
+    terms = aggregator()
+    terms.write_csv(str(tmp_path / 'basic.csv'), n=3)
+    with open(tmp_path / 'basic.csv', newline='') as f:
+        assert [(row['search_term'], int(row['total'])) for row in csv.DictReader(f)] == terms.top(3)
+
+
+def test_write_json_matches_json_dumps(tmp_path):
+    terms = aggregator()
+    for n in (None, 3):
+        filename = tmp_path / 'full.json'
+        terms.write_json(str(filename), n)
+        assert filename.read_text() == json.dumps(list(terms.items(n)), indent=4)
+    empty = tmp_path / 'empty.json'
+    SearchTermAggregator().write_json(str(empty))
+    assert empty.read_text() == json.dumps([], indent=4)
+
+
+def test_normalize_term():
+    assert normalize_term('Knoxville') == normalize_term('knoxville%20') == 'knoxville'
+    assert normalize_term('  Civil%20%20War ') == 'civil war'
+    assert normalize_term('a+b') == 'a+b'
+
+
+def test_top_k_matches_brute_force():
+    generator = random.Random(7)
+    counts = Counter()
+    top = TopK(10)
+    for _ in range(5000):
+        term = f"t{int(generator.paretovariate(1.2)) % 300}"
+        counts[term] += generator.randint(1, 5)
+        top.update(term, counts[term])
+    result = top.top()
+    assert [count for _, count in result] == sorted(counts.values(), reverse=True)[:10]
+    assert all(counts[term] == count for term, count in result)
+    assert [count for _, count in top.top(3)] == sorted(counts.values(), reverse=True)[:3]
+
+
+def test_index_top_and_prefix(tmp_path):
+    generator = random.Random(11)
+    index = SearchTermIndex(k=5)
+    overall = Counter()
+    per_collection = {}
+    for _ in range(2000):
+        term = generator.choice(['knox', 'knoxville', 'knot', 'music', 'mural', 'map']) + str(generator.randint(0, 9))
+        collection = generator.choice([None, 'c1', 'c2'])
+        views = generator.randint(1, 20)
+        index.add(term, views, collection)
+        overall[term] += views
+        if collection is not None:
+            per_collection.setdefault(collection, Counter())[term] += views
+
+    def counts(result):
+        return [count for _, count in result]
+
+    assert counts(index.top()) == sorted(overall.values(), reverse=True)[:5]
+    assert counts(index.top(20)) == sorted(overall.values(), reverse=True)[:20]
+    for collection, expected in per_collection.items():
+        assert counts(index.top(5, collection)) == sorted(expected.values(), reverse=True)[:5]
+    knox = {term: views for term, views in overall.items() if term.startswith('knox')}
+    assert counts(index.prefix('KNOX', n=100)) == sorted(knox.values(), reverse=True)
+    assert index.prefix('zzz') == []
+
+    index.save(str(tmp_path / 'index.json'))
+    loaded = SearchTermIndex.load(str(tmp_path / 'index.json'))
+    assert loaded.counts == index.counts
+    assert loaded.by_collection == index.by_collection
+    assert counts(loaded.top()) == counts(index.top())
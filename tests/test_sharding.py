@@ -0,0 +1,112 @@
+from analytics.connection import ReportingConnection
+from analytics.fake import FakeReportingService
+from analytics.sharding import DateRangeSharder, halve, resolve_date, split_range
+from collections import Counter
+import datetime
+
+REQUEST = {
+    'viewId': '118513499',
+    'dateRanges': [{'startDate': '2022-01-01', 'endDate': '2022-03-31'}],
+    'dimensions': [{'name': 'ga:pagePath'}, {'name': 'ga:source'}],
+    'metrics': [{'expression': 'ga:pageviews'}, {'expression': 'ga:sessions'}],
+    'pageSize': 100,
+}
+
+
+def day(value):
+    return datetime.date.fromisoformat(value)
+
+
+class RecordingService(FakeReportingService):
+    """Remembers the date range of every request it answers."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ranges = set()
+
+    def report(self, report_request):
+        date_range = report_request['dateRanges'][0]
+        self.ranges.add((day(date_range['startDate']), day(date_range['endDate'])))
+        return super().report(report_request)
+
+
+def factory(service):
+    return lambda: ReportingConnection(credentials=None, view_id='118513499', service=service)
+
+
+def merged(service, ranges):
+    """The rows of each range fetched on its own, merged on their dimensions."""
+    totals = Counter()
+    connection = factory(service)()
+    for start, end in ranges:
+        request = dict(REQUEST, dateRanges=[{'startDate': start.isoformat(), 'endDate': end.isoformat()}])
+        for row in connection.iter_report_rows(request):
+            for i, value in enumerate(row['metrics'][0]['values']):
+                totals[(tuple(row['dimensions']), i)] += int(value)
+    return totals
+
+
+def flatten(fetched):
+    return Counter({(key, i): value for key, values in fetched.items() for i, value in enumerate(values)})
+
+
+def assert_tiles(ranges, start, end):
+    ranges = sorted(ranges)
+    assert ranges[0][0] == start and ranges[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert next_start == previous_end + datetime.timedelta(days=1)
+
+
+def test_resolve_date():
+    today = datetime.date(2023, 3, 10)
+    assert resolve_date('today', today) == today
+    assert resolve_date('yesterday', today) == datetime.date(2023, 3, 9)
+    assert resolve_date('365daysAgo', today) == datetime.date(2022, 3, 10)
+    assert resolve_date('2022-01-31', today) == datetime.date(2022, 1, 31)
+
+
+def test_split_range_and_halve():
+    shards = split_range(day('2022-01-01'), day('2022-03-31'), 31)
+    assert shards == [
+        (day('2022-01-01'), day('2022-01-31')),
+        (day('2022-02-01'), day('2022-03-03')),
+        (day('2022-03-04'), day('2022-03-31')),
+    ]
+    assert split_range(day('2022-01-01'), day('2022-01-01'), 31) == [(day('2022-01-01'), day('2022-01-01'))]
+    assert halve(day('2022-01-01'), day('2022-01-04')) == [
+        (day('2022-01-01'), day('2022-01-02')),
+        (day('2022-01-03'), day('2022-01-04')),
+    ]
+
+
+def test_shards_merge_into_one_report():
+    service = RecordingService(rows_per_day=5, distinct_paths=40)
+    sharder = DateRangeSharder(factory(service), shard_days=10, workers=3)
+    fetched = sharder.fetch(REQUEST)
+    shards = split_range(day('2022-01-01'), day('2022-03-31'), 10)
+    assert sharder.shards_fetched == len(shards)
+    assert sharder.shards_split == 0
+    assert service.ranges == set(shards)
+    assert flatten(fetched) == merged(service, shards)
+    rows = list(sharder.iter_rows(REQUEST))
+    assert len(rows) == len(fetched)
+    assert all(len(row['metrics'][0]['values']) == 2 for row in rows)
+
+
+def test_large_shards_are_halved():
+    service = RecordingService(rows_per_day=20, distinct_paths=1000)
+    sharder = DateRangeSharder(factory(service), shard_days=31, max_rows=150, workers=2)
+    fetched = sharder.fetch(REQUEST)
+    final = {(start, end) for start, end in service.ranges if ((end - start).days + 1) * 20 <= 150}
+    assert sharder.shards_split > 0
+    assert sharder.shards_fetched == len(final)
+    assert_tiles(final, day('2022-01-01'), day('2022-03-31'))
+    assert flatten(fetched) == merged(service, final)
+
+
+def test_sampled_shards_are_halved_down_to_min_days():
+    service = RecordingService(rows_per_day=3, sampled=True)
+    request = dict(REQUEST, dateRanges=[{'startDate': '2022-01-01', 'endDate': '2022-01-08'}])
+    sharder = DateRangeSharder(factory(service), shard_days=8, min_days=2)
+    sharder.fetch(request)
+    assert sharder.shards_fetched == 4
+    assert sharder.shards_split == 3
@@ -0,0 +1,134 @@
+from analytics import merge
+from analytics.fake import FakeReportingService
+from analytics.rows import PathDictionary, RowStore
+from analytics.streamer import (
+    STREAM_HOST,
+    AsyncAnalyticsConnection,
+    AsyncCrawlScheduler,
+    CrawlScheduler,
+    Crawler,
+    MonthBuilder,
+    MonthCheckpoints,
+    MonthlyPivot,
+)
+import asyncio
+import datetime
+import os
+import time
+
+JANUARY = {'start': '2022-01-01', 'end': '2022-01-31', 'name': 'Jan 2022'}
+
+
+class StaticConnection:
+    """Returns the same (path, views) rows for every month."""
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def iter_rows(self, start_date, end_date):
+        return rows(self.pairs)
+
+
+def written_on(filename, day):
+    timestamp = time.mktime(datetime.datetime.combine(day, datetime.time(12)).timetuple())
+    os.utime(filename, (timestamp, timestamp))
+
+
+def rows(pairs):
+    return [{'dimensions': [path], 'metrics': [{'values': [str(views)]}]} for path, views in pairs]
+
+
+def test_month_builder():
+    months = MonthBuilder(start='2023-11', end='2024-02').months
+    assert months == [
+        {'start': '2023-11-01', 'end': '2023-11-30', 'name': 'Nov 2023'},
+        {'start': '2023-12-01', 'end': '2023-12-31', 'name': 'Dec 2023'},
+        {'start': '2024-01-01', 'end': '2024-01-31', 'name': 'Jan 2024'},
+        {'start': '2024-02-01', 'end': '2024-02-29', 'name': 'Feb 2024'},
+    ]
+
+
+def test_checkpoints_round_trip(tmp_path):
+    checkpoints = MonthCheckpoints(str(tmp_path))
+    crawler = Crawler(JANUARY, connection=StaticConnection([('/a', 2), ('/b', 3), ('/a', 1)]))
+    checkpoints.save(crawler)
+    assert checkpoints.has(JANUARY)
+    assert list(checkpoints.load(JANUARY)) == [('/a', 3), ('/b', 3)]
+    with open(checkpoints.filename(JANUARY)) as f:
+        assert f.read().splitlines()[1] == f"{STREAM_HOST}/a,3"
+
+
+def test_open_months_are_not_saved(tmp_path):
+    checkpoints = MonthCheckpoints(str(tmp_path))
+    today = datetime.date.today()
+    month = {'start': today.replace(day=1).isoformat(), 'end': today.isoformat(), 'name': 'Now'}
+    assert not checkpoints.save(Crawler(month, connection=StaticConnection([('/a', 1)])))
+    assert not os.path.exists(checkpoints.filename(month))
+    assert not checkpoints.has(month)
+
+
+def test_checkpoints_written_while_open_are_not_trusted(tmp_path):
+    checkpoints = MonthCheckpoints(str(tmp_path))
+    assert checkpoints.save(Crawler(JANUARY, connection=StaticConnection([('/a', 1)])))
+    filename = checkpoints.filename(JANUARY)
+    written_on(filename, datetime.date(2022, 1, 20))
+    assert not checkpoints.has(JANUARY)
+    written_on(filename, datetime.date(2022, 2, 2))
+    assert not checkpoints.has(JANUARY)
+    written_on(filename, datetime.date(2022, 2, 3))
+    assert checkpoints.has(JANUARY)
+    assert merge.MonthFileMerger([JANUARY], directory=str(tmp_path), workers=1).months == [JANUARY]
+    written_on(filename, datetime.date(2022, 1, 31))
+    assert merge.MonthFileMerger([JANUARY], directory=str(tmp_path), workers=1).missing == [JANUARY]
+
+
+def test_row_store_sums_repeated_paths():
+    store = RowStore().add_rows(rows([('/a', 2), ('/b', 3), ('/a', 1)]))
+    assert list(store.items()) == [('/a', 3), ('/b', 3)]
+    store.add('/a', 10)
+    store.add('/c', 1)
+    assert list(store.items(prefix='x')) == [('x/a', 13), ('x/b', 3), ('x/c', 1)]
+    assert len(store) == 3 and len(store.dictionary) == 3
+
+
+def test_row_store_sums_pages_like_one_batch():
+    generator = [(f"/media/{i % 37}", i % 5 + 1) for i in range(500)]
+    whole = RowStore().add_rows(rows(generator)).compact()
+    paged = RowStore()
+    for start in range(0, 500, 60):
+        paged.add_rows(rows(generator[start:start + 60]))
+    paged.compact()
+    assert list(paged.items()) == list(whole.items())
+    paged.add('/media/0', 100)
+    paged.add('/media/new', 1)
+    assert dict(paged.items())['/media/0'] == dict(whole.items())['/media/0'] + 100
+    assert len(paged) == len(whole) + 1
+
+
+def test_pivot_shares_the_crawl_dictionary():
+    dictionary = PathDictionary()
+    months = MonthBuilder(start='2022-01', end='2022-02').months
+    pivot = MonthlyPivot(months, dictionary=dictionary, prefix=STREAM_HOST)
+    pivot.add_store(RowStore(dictionary).add_rows(rows([('/a', 1), ('/b', 2)])), 'Jan 2022')
+    pivot.add_store(RowStore().add_rows(rows([('/b', 5), ('/c', 1)])), 'Feb 2022')
+    assert list(pivot.rows()) == [
+        {'path': f"{STREAM_HOST}/a", 'Jan 2022': 1},
+        {'path': f"{STREAM_HOST}/b", 'Jan 2022': 2, 'Feb 2022': 5},
+        {'path': f"{STREAM_HOST}/c", 'Feb 2022': 1},
+    ]
+
+
+def test_async_crawl_matches_threaded_crawl():
+    months = MonthBuilder(start='2022-01', end='2022-03').months
+    service = FakeReportingService(rows_per_day=10, page_size=70, distinct_paths=250)
+    threaded = {
+        crawler.current_month['name']: dict(crawler.current_results.items())
+        for crawler in CrawlScheduler(service=service, workers=2).crawl(months)
+    }
+    crawled = {}
+    connection = AsyncAnalyticsConnection(credentials=None, view_id='42472462', concurrency=3, service=service)
+    asyncio.run(
+        AsyncCrawlScheduler(connection).crawl(
+            months, lambda crawler: crawled.update({crawler.current_month['name']: dict(crawler.current_results.items())})
+        )
+    )
+    assert crawled == threaded